@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Benchmark Sphinx builds of every robot directive in every style
+
+Generates a synthetic corpus (see ``corpus.py``) and builds one Sphinx
+project per directive and style in a separate process, reporting the wall
+time, peak resident set size and doctree pickle size of every build.
+
+Usage::
+
+    python benchmarks/bench_build.py [--builder html] [--json report.json]
+                                     [--tests 500] [--keywords 500] [...]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+PACKAGE = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+CONF = '''\
+import sys
+sys.path.insert(0, %r)
+extensions = ['sphinxcontrib_robotdoc']
+master_doc = 'index'
+'''
+
+STYLES = ('minimal', 'default', 'expanded')
+
+CASES = [
+    ('robot-tests', 'suite.robot', STYLES, {}),
+    ('robot-tests', 'tree', STYLES, {}),
+    ('robot-tests', 'data.robot', STYLES + ('summary',), {}),
+    ('robot-keywords', 'keywords.robot', STYLES, {}),
+    ('robot-library', 'keywords.robot', STYLES, {}),
+    ('robot-settings', 'suite.robot', STYLES, {}),
+    ('robot-variables', 'suite.robot', STYLES, {}),
+    ('robot-source', 'suite.robot', (None,), {}),
+    ('robot-source', 'suite.robot', (None,), {'lines': '100-2000'}),
+    ('robot-source', 'suite.robot', (None,), {'max-lines': '1000'}),
+]
+
+
+def write_project(path, corpus_path, directive, source, style, extra):
+    os.makedirs(path)
+    with open(os.path.join(path, 'conf.py'), 'w') as fp:
+        fp.write(CONF % PACKAGE)
+    options = ['   :source: %s' % os.path.join(corpus_path, source)]
+    if style:
+        options.append('   :style: %s' % style)
+    for name, value in sorted(extra.items()):
+        options.append('   :%s: %s' % (name, value))
+    with open(os.path.join(path, 'index.rst'), 'w') as fp:
+        fp.write('Benchmark\n=========\n\n.. %s::\n%s\n' % (
+            directive, '\n'.join(options)))
+
+
+def build(path, builder):
+    """Build the project and return (wall time, peak RSS in kB)"""
+    args = [sys.executable, '-m', 'sphinx', '-q', '-b', builder,
+            '-d', os.path.join(path, '_build', 'doctrees'),
+            path, os.path.join(path, '_build', builder)]
+    started = time.time()
+    process = subprocess.Popen(args)
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - started
+    if status:
+        raise RuntimeError('Build failed: %s' % ' '.join(args))
+    rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        rss = rss // 1024  # bytes on macOS
+    return elapsed, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--builder', default='html')
+    parser.add_argument('--json', help='write the results into a JSON file')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the generated projects')
+    corpus.add_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='robotdoc-bench-')
+    corpus_path = os.path.join(workdir, 'corpus')
+    corpus.generate_from_arguments(corpus_path, args)
+
+    results = []
+    print('%-16s %-15s %-9s %-16s %9s %10s %12s' % (
+        'directive', 'source', 'style', 'options', 'time (s)', 'RSS (MB)',
+        'doctree (kB)'))
+    try:
+        for idx, (directive, source, styles, extra) in enumerate(CASES):
+            for style in styles:
+                path = os.path.join(workdir, '%s-%s-%s-%d' % (
+                    directive, source.replace('.', '_'), style, idx))
+                write_project(path, corpus_path, directive, source, style,
+                              extra)
+                elapsed, rss = build(path, args.builder)
+                doctree = os.path.getsize(os.path.join(
+                    path, '_build', 'doctrees', 'index.doctree'))
+                results.append({
+                    'directive': directive,
+                    'source': source,
+                    'style': style,
+                    'options': extra,
+                    'builder': args.builder,
+                    'time': elapsed,
+                    'rss': rss * 1024,
+                    'doctree': doctree,
+                })
+                print('%-16s %-15s %-9s %-16s %9.2f %10.1f %12.1f' % (
+                    directive, source, style or '-', ' '.join(
+                        ':%s: %s' % item for item in sorted(extra.items()))
+                    or '-', elapsed, rss / 1024., doctree / 1024.))
+    finally:
+        if args.keep:
+            print('Projects kept in %s' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark for highlighting the steps of user keywords
+
+Compares the per-keyword cost of rendering highlighted keyword steps with
+shared lexer and formatter instances and precompiled style patterns against
+looking up the lexer, creating the formatters and compiling the patterns for
+every keyword, like it was done before.
+
+Usage::
+
+    python benchmarks/bench_render.py [--keywords 1000] [--repeat 3]
+"""
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.formatters import LatexFormatter
+from pygments.lexers import get_lexer_by_name
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import sphinxcontrib_robotdoc  # noqa: E402
+
+
+def generate_keywords(count):
+    keywords = []
+    for idx in range(count):
+        keywords.append(
+            '***Keywords***\n\nKeyword %d\n' % idx +
+            '    ${value} =  Get Value  ${argument %d}\n' % idx +
+            '    Given value is set  ${value}\n' +
+            '     When value is used\n' +
+            '     Then value should be  expected %d\n' % idx +
+            '      And Log  ${value}\n'
+        )
+    return keywords
+
+
+def render_before(steps, fmt):
+    lexer = get_lexer_by_name('robotframework')
+    if fmt == 'html':
+        formatter = HtmlFormatter(noclasses=False)
+        parsed = highlight(steps, lexer, formatter)
+        parsed = re.sub('<span class="gh">[^\n]+\n\n', '', parsed)
+        parsed = re.sub('<span class="gu">[^<]+</span>', '', parsed)
+        parsed = re.sub('<pre><span class="p"></span>', '<pre>', parsed)
+        parsed = re.sub('<span class="p">    ', '<span class="p">', parsed)
+    else:
+        formatter = LatexFormatter()
+        parsed = highlight(steps, lexer, formatter)
+        parsed = re.sub(r'\\PY{g\+gh}{[^}]+}\n\n', '', parsed)
+        parsed = re.sub(r'\\PY{g\+gu}{[^}]+}\n', '', parsed)
+    return parsed
+
+
+def render_after(steps, fmt):
+    node = sphinxcontrib_robotdoc.robot_code('', code=steps, style='default')
+    return sphinxcontrib_robotdoc.render_code(node, fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--keywords', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    keywords = generate_keywords(args.keywords)
+    for fmt in ('html', 'latex'):
+        for steps in keywords[:10]:
+            assert render_before(steps, fmt) == render_after(steps, fmt)
+        for name, render in (('before', render_before),
+                             ('after', render_after)):
+            best = min(timeit.repeat(
+                lambda: [render(steps, fmt) for steps in keywords],
+                number=1, repeat=args.repeat))
+            print('%-6s %-7s %8.1f us/keyword  (%d keywords, %.3f s)' % (
+                fmt, name, best / len(keywords) * 1e6, len(keywords), best))
+
+
+if __name__ == '__main__':
+    main()
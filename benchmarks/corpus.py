@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Robot Framework corpora for benchmarking
+
+Usage::
+
+    python benchmarks/corpus.py OUTPUT_DIRECTORY [--tests 500] [...]
+"""
+import argparse
+import os
+
+PARAGRAPH = (
+    'Lorem ipsum dolor sit amet, *consectetur* adipiscing elit, sed do '
+    'eiusmod tempor incididunt ut labore et **dolore** magna aliqua. '
+    'Ut enim ad minim veniam, quis nostrud ``exercitation`` ullamco.'
+)
+
+
+def documentation(paragraphs, indent='    '):
+    rows = []
+    for idx in range(paragraphs):
+        if idx:
+            rows.append(indent + '...')
+        rows.append(indent + '...  ' + PARAGRAPH)
+    rows[0] = rows[0].replace('...  ', '', 1)
+    return '\n'.join(rows)
+
+
+def steps(count, keyword='Do Something'):
+    prefixes = ['Given ', 'When ', 'Then ', 'And ', '']
+    rows = []
+    for idx in range(count):
+        rows.append('    %s%s  ${VARIABLE %d}  argument %d' % (
+            prefixes[idx % len(prefixes)], keyword, idx % 10, idx))
+    return '\n'.join(rows)
+
+
+def generate_suite(tests, keywords, variables, doc_paragraphs, step_count,
+                   name='Test'):
+    out = ['*** Settings ***',
+           'Documentation    ' + documentation(doc_paragraphs, ''),
+           'Library          OperatingSystem',
+           'Resource         keywords.robot',
+           '',
+           '*** Variables ***']
+    for idx in range(variables):
+        out.append('${VARIABLE %d}    value %d' % (idx, idx))
+    out.extend(['', '*** Test Cases ***'])
+    for idx in range(tests):
+        out.append('%s %d' % (name, idx))
+        out.append('    [Documentation]  ' + documentation(doc_paragraphs)
+                   .lstrip())
+        out.append('    [Tags]  tag-%d  group-%d' % (idx % 10, idx % 3))
+        out.append(steps(step_count))
+        out.append('')
+    if keywords:
+        out.extend(['*** Keywords ***'])
+        out.append(generate_keywords(keywords, doc_paragraphs, step_count,
+                                     header=False))
+    return '\n'.join(out) + '\n'
+
+
+def generate_data_suite(tests, rows):
+    out = ['*** Settings ***',
+           'Test Template    Keyword 0',
+           '',
+           '*** Test Cases ***    First    Second']
+    for idx in range(tests):
+        out.append('Data %d' % idx)
+        for row in range(rows):
+            out.append('    value %d    argument %d' % (row, row % 10))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def generate_keywords(keywords, doc_paragraphs, step_count, header=True):
+    out = header and ['*** Keywords ***'] or []
+    for idx in range(keywords):
+        out.append('Keyword %d' % idx)
+        out.append('    [Documentation]  ' + documentation(doc_paragraphs)
+                   .lstrip())
+        out.append('    [Arguments]  ${first}  ${second}=default')
+        out.append(steps(step_count, 'Log'))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def generate_tree(path, depth, breadth, tests, doc_paragraphs, step_count,
+                  prefix='Tree'):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if depth == 0:
+        return
+    for idx in range(breadth):
+        name = '%s %d' % (prefix, idx)
+        with open(os.path.join(path, 'suite_%d.robot' % idx), 'w') as fp:
+            fp.write(generate_suite(tests, 0, 0, doc_paragraphs, step_count,
+                                    name=name))
+        generate_tree(os.path.join(path, 'level_%d' % idx), depth - 1,
+                      breadth, tests, doc_paragraphs, step_count, name)
+
+
+def generate(path, tests=500, keywords=500, variables=1000, depth=3,
+             breadth=3, tree_tests=10, doc_paragraphs=3, step_count=10,
+             data_rows=1000):
+    """Generate suite.robot, keywords.robot, data.robot and tree/"""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'suite.robot'), 'w') as fp:
+        fp.write(generate_suite(tests, 0, variables, doc_paragraphs,
+                                step_count))
+    with open(os.path.join(path, 'keywords.robot'), 'w') as fp:
+        fp.write(generate_keywords(keywords, doc_paragraphs, step_count))
+    with open(os.path.join(path, 'data.robot'), 'w') as fp:
+        fp.write(generate_data_suite(max(tests // 10, 1), data_rows))
+    generate_tree(os.path.join(path, 'tree'), depth, breadth, tree_tests,
+                  doc_paragraphs, step_count)
+
+
+def add_arguments(parser):
+    parser.add_argument('--tests', type=int, default=500,
+                        help='number of tests in suite.robot')
+    parser.add_argument('--keywords', type=int, default=500,
+                        help='number of keywords in keywords.robot')
+    parser.add_argument('--variables', type=int, default=1000,
+                        help='number of variables in suite.robot')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='depth of the suite directory tree')
+    parser.add_argument('--breadth', type=int, default=3,
+                        help='suites and sub directories per directory')
+    parser.add_argument('--tree-tests', type=int, default=10,
+                        help='number of tests per suite in the tree')
+    parser.add_argument('--doc-paragraphs', type=int, default=3,
+                        help='paragraphs of documentation per test/keyword')
+    parser.add_argument('--steps', type=int, default=10,
+                        help='steps per test and keyword')
+    parser.add_argument('--data-rows', type=int, default=1000,
+                        help='data rows per templated test in data.robot')
+
+
+def generate_from_arguments(path, args):
+    generate(path, tests=args.tests, keywords=args.keywords,
+             variables=args.variables, depth=args.depth,
+             breadth=args.breadth, tree_tests=args.tree_tests,
+             doc_paragraphs=args.doc_paragraphs, step_count=args.steps,
+             data_rows=args.data_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path')
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate_from_arguments(args.path, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,6 @@ setup(
     # Get more strings from
     # http://pypi.python.org/pypi?%3Aaction=list_classifiers
     classifiers=[
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3'
     ],
     keywords='',
@@ -19,9 +18,10 @@ setup(
     url='https://github.com/datakurre/sphinxcontrib-robotdoc/',
     license='GPL',
     py_modules=['sphinxcontrib_robotdoc'],
+    python_requires='>=3.6',
     install_requires=[
-        'setuptools',
-        'sphinx',
+        'sphinx>=1.8',
+        'docutils>=0.18.1',
         'pygments>=1.6rc1',
         'robotframework>=2.7.1'
     ]
@@ -2,32 +2,921 @@
 """Robot Framework AutoDoc for Sphinx"""
 from docutils import statemachine
 from docutils.parsers.rst import directives
-from pygments import highlight
-# noinspection PyUnresolvedReferences
-from pygments.formatters import HtmlFormatter
-# noinspection PyUnresolvedReferences
-from pygments.formatters import LatexFormatter
-from pygments.lexers import get_lexer_by_name
 from docutils.parsers.rst import Directive
 from docutils import nodes
+from sphinx import addnodes
+from sphinx.domains import Domain
+from sphinx.domains import ObjType
+from sphinx.roles import XRefRole
+from sphinx.transforms.post_transforms import SphinxPostTransform
+from sphinx.util.nodes import make_refnode
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from contextlib import contextmanager
+from sphinx.util import logging
+from timeit import default_timer
+import bisect
+import functools
+import codecs
+import csv
+import glob
+import hashlib
+import importlib.util
+import io
+import json
+import mmap
 import os
-import pkg_resources
+import pickle
 import re
-import robot
+import tempfile
+
+logger = logging.getLogger(__name__)
 
 
 def flatten(list_):
     return [item for sub_list in list_ for item in sub_list]
 
 
+class Profiler(object):
+    """Per-directive timing and cache statistics (``robotdoc_profile``)
+
+    Records are dictionaries stored into the environment by document, so
+    that they are merged from parallel readers like any other environment
+    data. Time spent in nested phases is only counted for the innermost
+    phase. Only records of the documents read by the current build
+    (``docnames``) are reported.
+    """
+    PHASES = ('resolve', 'parse', 'filter', 'nested_parse', 'highlight')
+    COUNTERS = ('cache_hits', 'cache_misses',
+                'disk_cache_hits', 'disk_cache_misses')
+
+    def __init__(self):
+        self.enabled = False
+        self.current = None
+        self.stack = []
+        self.docnames = set()
+
+    @contextmanager
+    def record(self, record):
+        """Collect timings into the given record"""
+        if not self.enabled:
+            yield record
+            return
+        current, stack = self.current, self.stack
+        self.current, self.stack = record, []
+        try:
+            with self.phase('total'):
+                yield record
+        finally:
+            self.current, self.stack = current, stack
+
+    def directive(self, directive):
+        """Return a new record for the given directive invocation"""
+        env = directive.state.document.settings.env
+        if not hasattr(env, 'robotdoc_profile'):
+            env.robotdoc_profile = {}
+        records = env.robotdoc_profile.setdefault(env.docname, [])
+        record = dict(
+            [(name, 0.0) for name in self.PHASES + ('total',)] +
+            [(name, 0) for name in self.COUNTERS],
+            id=[env.docname, len(records)],
+            docname=env.docname,
+            line=directive.lineno,
+            directive=directive.name,
+            source=None,
+        )
+        records.append(record)
+        return self.record(record)
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the block into the current record"""
+        if self.current is None:
+            yield
+            return
+        frame = [default_timer(), 0.0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = default_timer() - frame[0]
+            if name == 'total':
+                self.current[name] += elapsed
+            else:
+                self.current[name] += elapsed - frame[1]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def count(self, name):
+        if self.current is not None:
+            self.current[name] += 1
+
+    def set(self, name, value):
+        if self.current is not None:
+            self.current[name] = value
+
+
+profiler = Profiler()
+
+
+def profiled(run):
+    """Decorate directive run method to be profiled"""
+    @functools.wraps(run)
+    def wrapper(self):
+        if not profiler.enabled:
+            return run(self)
+        with profiler.directive(self):
+            return run(self)
+    return wrapper
+
+
+def resolve_resource(package, resource):
+    """Return filesystem path for the given package resource or None"""
+    try:
+        spec = importlib.util.find_spec(package)
+    except (ImportError, ValueError):
+        return None
+    if spec is None:
+        return None
+    if spec.has_location and spec.origin:
+        locations = [os.path.dirname(spec.origin)]
+    else:
+        locations = list(spec.submodule_search_locations or [])
+    for location in locations:
+        path = os.path.join(location, *resource.split('/'))
+        if os.path.exists(path):
+            return path
+    return None
+
+
 def resolve_path(spec, cwd):
-    if os.path.isfile(os.path.normpath(os.path.join(cwd, spec))):
-        return os.path.normpath(os.path.join(cwd, spec))
-    elif spec.count(':') and pkg_resources.resource_exists(
-            *spec.split(':', 1)):
-        return pkg_resources.resource_filename(*spec.split(':', 1))
+    """Resolve path relative to the document or 'package:resource' path
+
+    Results are memoized for the duration of the build.
+    """
+    if (spec, cwd) in resolved_paths:
+        return resolved_paths[(spec, cwd)]
+    with profiler.phase('resolve'):
+        if os.path.exists(os.path.normpath(os.path.join(cwd, spec))):
+            path = os.path.normpath(os.path.join(cwd, spec))
+        elif spec.count(':'):
+            path = resolve_resource(*spec.split(':', 1)) or spec
+        else:
+            path = spec
+    resolved_paths[(spec, cwd)] = path
+    return path
+
+
+resolved_paths = {}
+
+
+def get_source_files(path, kind='suite'):
+    """Return the Robot files read from a directory
+
+    Suite directories (``kind='suite'``) are read as test suites and
+    keyword library directories (``kind='resource'``) as resource files.
+    """
+    if kind == 'resource':
+        return get_resource_files(path)
+    init, files = get_suite_files(path)
+    return (init and [init] or []) + files
+
+
+def get_source_signature(path, kind='suite'):
+    """Return (signature, size) identifying the current state of a source
+
+    Files are identified by their resolved path, mtime and size. Directories
+    are identified by their resolved path and kind, and the same information
+    for every Robot file read from them.
+    """
+    path = os.path.realpath(path)
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return (path, stat.st_mtime, stat.st_size), stat.st_size
+    files = []
+    size = 0
+    for filename in get_source_files(path, kind):
+        stat = os.stat(filename)
+        files.append((filename, stat.st_mtime, stat.st_size))
+        size += stat.st_size
+    return ((path, kind), tuple(files)), size
+
+
+class ParsedSourceCache(object):
+    """Process-wide LRU cache for parsed Robot Framework data
+
+    Entries are evicted in least recently used order once the total size of
+    the cached sources exceeds ``capacity`` bytes (``robotdoc_cache_size``).
+    """
+
+    def __init__(self, capacity=32 * 1024 * 1024):
+        self.capacity = capacity
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, kind, path, loader):
+        signature, size = get_source_signature(path)
+        return self.lookup((kind, signature[0]), signature, size,
+                           lambda: loader(path))
+
+    def lookup(self, key, signature, size, loader):
+        """Return cached value for the key or cache the value of loader()
+
+        Without ``size`` the length of the loaded value is used as its size.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            if entry[0] == signature:
+                self.entries[key] = entry
+                profiler.count('cache_hits')
+                return entry[2]
+            self.size -= entry[1]
+        profiler.count('cache_misses')
+        value = loader()
+        if size is None:
+            size = len(value)
+        if size <= self.capacity:
+            self.entries[key] = (signature, size, value)
+            self.size += size
+            self.resize(self.capacity)
+        return value
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while self.size > self.capacity:
+            self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+parsed_sources = ParsedSourceCache()
+
+
+class DiskCache(object):
+    """Persistent cache for parsed sources and rendered output
+
+    Values are pickled below ``path`` (``robotdoc_cache_dir``) under a hash
+    of their key, the Pygments and Robot Framework versions and the cache
+    format version. The cache is disabled while ``path`` is not set.
+    """
+    VERSION = 4
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def get(self, key, loader):
+        """Return cached or loaded value
+
+        The key may also be a function returning the key, which is called
+        only while the cache is enabled.
+        """
+        if not self.path:
+            return loader()
+        if callable(key):
+            key = key()
+        import pygments
+        import robot.version
+        key = repr((self.VERSION, pygments.__version__,
+                    robot.version.VERSION) + tuple(key))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        filename = os.path.join(self.path, digest[:2], digest)
+        try:
+            with open(filename, 'rb') as fp:
+                value = pickle.load(fp)
+            profiler.count('disk_cache_hits')
+            return value
+        except Exception:  # missing, corrupted or incompatible entry
+            pass
+        profiler.count('disk_cache_misses')
+        value = loader()
+        self.put(filename, value)
+        return value
+
+    def put(self, filename, value):
+        """Store the value, ignoring errors as the cache is optional"""
+        if not os.path.isdir(os.path.dirname(filename)):
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:  # created by a parallel process or read-only
+                pass
+        temp = None
+        try:
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(filename))
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, filename)
+        except OSError:
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+
+
+rendered_sources = DiskCache()
+
+
+class SourceReader(object):
+    """Read, hash and decode Robot sources
+
+    Each file is memory mapped once to compute its content hash and decode
+    it with ``encoding`` (``robotdoc_source_encoding``). The decoded text is
+    kept in the parsed source cache to be shared by the tokenizer and the
+    parser. Files larger than ``stream_size`` (``robotdoc_stream_size``) are
+    only hashed until they are explicitly read.
+    """
+
+    def __init__(self, encoding='utf-8-sig', stream_size=4 * 1024 * 1024):
+        self.encoding = encoding
+        self.stream_size = stream_size
+
+    def load(self, path, decode=True):
+        """Return content hash and decoded text of the given file"""
+        with open(path, 'rb') as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                return hashlib.sha1().hexdigest(), u''
+            buffer_ = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                digest = hashlib.sha1(buffer_).hexdigest()
+                if decode:
+                    text = codecs.decode(buffer_, self.encoding)
+                else:
+                    text = None
+            finally:
+                buffer_.close()
+        return digest, text
+
+    def read(self, path):
+        """Return cached decoded text of the given file"""
+        return parsed_sources.get('text', path, self.load)[1]
+
+    def open(self, path):
+        """Return the given file opened for streaming decoded text"""
+        return io.open(path, 'r', encoding=self.encoding)
+
+    def hash(self, path):
+        """Return a content hash of the given file or suite directory
+
+        Suite directories are hashed from the files Robot Framework would
+        parse from them.
+        """
+        if not os.path.isdir(path):
+            if os.path.getsize(path) > self.stream_size:
+                return self.load(path, decode=False)[0]
+            return parsed_sources.get('text', path, self.load)[0]
+        digest = hashlib.sha1()
+        for filename in get_source_files(path):
+            digest.update(os.path.relpath(filename, path).encode('utf-8'))
+            digest.update(self.load(filename, decode=False)[0]
+                          .encode('utf-8'))
+        return digest.hexdigest()
+
+
+sources = SourceReader()
+
+
+def get_source_hash(path):
+    """Return cached content hash of the given source"""
+    return parsed_sources.get('hash', path, sources.hash)
+
+
+def setting_name(cell):
+    """Return normalized setting name for the given '[Setting]' cell"""
+    return cell.strip('[] ').replace(' ', '').lower()
+
+
+class Suite(object):
+    """Parsed test suite, suite directory or resource file
+
+    The compact intermediate representation produced by both parsing backends
+    and consumed by the caches and renderers. Tests of suite directories are
+    flattened into ``tests`` in their execution order.
+    """
+    __slots__ = ('source', 'doc', 'tests', 'keywords')
+
+    def __init__(self, source, doc=u'', tests=(), keywords=()):
+        self.source = source
+        self.doc = doc
+        self.tests = tests
+        self.keywords = keywords
+
+
+class Test(object):
+    """Test case with its settings and flattened steps
+
+    Data-driven tests also hold the name of their effective ``template``
+    keyword and the column names (``columns``) of their table heading.
+    """
+    __slots__ = ('name', 'doc', 'tags', 'settings', 'steps', 'source',
+                 'template', 'columns')
+
+    def __init__(self, name, doc=u'', tags=(), settings=(), steps=(),
+                 source=None, template=None, columns=()):
+        self.name = name
+        self.doc = doc
+        self.tags = tags
+        self.settings = settings
+        self.steps = steps
+        self.source = source
+        self.template = template
+        self.columns = columns
+
+    def get_setting(self, name):
+        """Return cells of the given setting, e.g. ('[Tags]', 'a'), or None"""
+        for cells in self.settings:
+            if setting_name(cells[0]) == name:
+                return cells
+        return None
+
+
+class Keyword(Test):
+    """User keyword with its settings and flattened steps"""
+    __slots__ = ()
+
+
+class Step(object):
+    """Row of cells in a test or keyword body at the given block level"""
+    __slots__ = ('level', 'cells')
+
+    def __init__(self, level, cells):
+        self.level = level
+        self.cells = cells
+
+
+# Extensions of suite files read from suite directories and, for plain text
+# formats, parsed from the shared decoded text
+SUITE_EXTENSIONS = ('.robot', '.txt', '.tsv', '.rst', '.rest')
+TEXT_EXTENSIONS = ('.robot', '.txt', '.tsv', '.resource')
+
+
+def get_model_cells(statement):
+    return tuple(token.value for token in statement.data_tokens)
+
+
+def get_model_steps(body, level=0):
+    """Return settings and flattened steps of the given model body
+
+    Blocks (FOR, IF, TRY, WHILE...) are flattened into their header row,
+    body rows one level deeper, else-branches and END row.
+    """
+    settings = []
+    steps = []
+    for item in body:
+        if getattr(item, 'header', None) is not None:
+            steps.extend(get_model_block(item, level))
+            continue
+        cells = get_model_cells(item)
+        if not cells:
+            continue
+        elif level == 0 and cells[0].startswith('[') and \
+                cells[0].endswith(']'):
+            settings.append(cells)
+        else:
+            steps.append(Step(level, cells))
+    return settings, steps
+
+
+def get_model_block(block, level):
+    steps = [Step(level, get_model_cells(block.header))]
+    steps.extend(get_model_steps(block.body, level + 1)[1])
+    branch = getattr(block, 'orelse', None) or getattr(block, 'next', None)
+    if branch is not None:
+        steps.extend(get_model_block(branch, level))
+    end = getattr(block, 'end', None)
+    if end is not None and any(get_model_cells(end)):
+        steps.append(Step(level, get_model_cells(end)))
+    return steps
+
+
+def get_model_doc(statements):
+    return u'\n'.join([statement.value for statement in statements
+                       if type(statement).__name__ == 'Documentation'])
+
+
+def get_template(template, settings):
+    """Return the effective template of a test or None"""
+    for cells in settings:
+        if setting_name(cells[0]) == 'template':
+            template = len(cells) > 1 and cells[1] or None
+    if template is None or template.upper() == 'NONE':
+        return None
+    return template
+
+
+def get_model_objects(klass, section, path, template=None):
+    objects = []
+    columns = tuple(get_model_cells(section.header)[1:]) \
+        if getattr(section, 'header', None) is not None else ()
+    for item in section.body:
+        if type(item).__name__ not in ('TestCase', 'Keyword'):
+            continue
+        settings, steps = get_model_steps(item.body)
+        tags = flatten([cells[1:] for cells in settings
+                        if setting_name(cells[0]) == 'tags'])
+        settings = [cells for cells in settings
+                    if setting_name(cells[0]) != 'documentation']
+        obj = klass(item.name, get_model_doc(item.body),
+                    tuple(tags), tuple(settings), steps, path)
+        if klass is Test:
+            obj.template = get_template(template, settings)
+            obj.columns = obj.template and columns or ()
+        objects.append(obj)
+    return objects
+
+
+def parse_model_file(path):
+    """Parse a single file with robot.api.get_model (Robot Framework 3.2+)"""
+    from robot.api import get_model
+    if os.path.splitext(path)[1].lower() in TEXT_EXTENSIONS:
+        model = get_model(io.StringIO(sources.read(path)), data_only=True)
     else:
-        return spec
+        model = get_model(path, data_only=True)
+    suite = Suite(path, tests=[], keywords=[])
+    template = None
+    for section in model.sections:
+        kind = type(section).__name__
+        if kind == 'SettingSection':
+            suite.doc = get_model_doc(section.body)
+            for statement in section.body:
+                if type(statement).__name__ == 'TestTemplate':
+                    template = statement.value
+    for section in model.sections:
+        kind = type(section).__name__
+        if kind == 'TestCaseSection':
+            suite.tests.extend(
+                get_model_objects(Test, section, path, template))
+        elif kind == 'KeywordSection':
+            suite.keywords.extend(get_model_objects(Keyword, section, path))
+    return suite
+
+
+def get_suite_files(path):
+    """Return (init file, suite files) of a suite directory
+
+    Suite files of the whole directory tree are returned in the order
+    Robot Framework executes them. Files and directories starting with '.'
+    or '_' are skipped.
+    """
+    init = None
+    files = []
+    for name in sorted(os.listdir(path), key=lambda name_: name_.lower()):
+        filename = os.path.join(path, name)
+        base, extension = os.path.splitext(name)
+        if extension.lower() not in SUITE_EXTENSIONS and \
+                not os.path.isdir(filename):
+            continue
+        elif base.lower() == '__init__' and not os.path.isdir(filename):
+            init = filename
+        elif name.startswith(('.', '_')):
+            continue
+        elif os.path.isdir(filename):
+            files.extend(get_suite_files(filename)[1])
+        else:
+            files.append(filename)
+    return init, files
+
+
+def parse_model_directory(path):
+    """Parse a suite directory like Robot Framework would execute it"""
+    init, files = get_suite_files(path)
+    suite = Suite(path, tests=[], keywords=[])
+    if init is not None:
+        init = parse_model_file(init)
+        suite.doc, suite.keywords = init.doc, init.keywords
+    for filename in files:
+        suite.tests.extend(parse_model_file(filename).tests)
+    return suite
+
+
+def get_legacy_steps(steps, level=0):
+    result = []
+    for step in steps:
+        if step.is_comment():
+            continue
+        result.append(Step(level, tuple(step.as_list())))
+        if step.is_for_loop():
+            result.extend(get_legacy_steps(step.steps, level + 1))
+            result.append(Step(level, ('END',)))
+    return result
+
+
+def get_legacy_settings(obj, names):
+    settings = []
+    for name in names:
+        setting = getattr(obj, name, None)
+        if setting is not None and len(setting.as_list()) > 1:
+            settings.append(tuple(setting.as_list()))
+    return tuple(settings)
+
+
+def get_legacy_tests(data):
+    tests = []
+    for test in data.testcase_table.tests:
+        settings = get_legacy_settings(
+            test, ('setup', 'teardown', 'tags', 'template', 'timeout'))
+        template = get_template(data.setting_table.test_template.value,
+                                settings)
+        tests.append(Test(
+            test.name, test.doc.value, tuple(test.tags.value or ()),
+            settings, get_legacy_steps(test.steps), data.source, template,
+            template and tuple(data.testcase_table.header[1:]) or ()))
+    for child in getattr(data, 'children', []):
+        tests.extend(get_legacy_tests(child))
+    return tests
+
+
+def parse_legacy(path):
+    """Parse with the robot.parsing model of Robot Framework before 3.2"""
+    from robot.errors import DataError
+    from robot.parsing import ResourceFile
+    from robot.parsing import TestData
+    try:
+        data = TestData(source=path)
+        tests = get_legacy_tests(data)
+    except DataError:
+        data = ResourceFile(source=path)
+        data.populate()
+        tests = []
+    keywords = [Keyword(keyword.name, keyword.doc.value,
+                        tuple(keyword.tags.value or ()),
+                        get_legacy_settings(keyword, ('args', 'return_',
+                                                      'teardown', 'timeout',
+                                                      'tags')),
+                        get_legacy_steps(keyword.steps), data.source)
+                for keyword in data.keywords]
+    return Suite(path, data.setting_table.doc.value, tests, keywords)
+
+
+def parse_source(path):
+    """Return cached :class:`Suite` for the given suite, directory or resource
+
+    Sources are parsed with ``robot.api.get_model`` when available and with
+    the legacy ``robot.parsing`` model of older Robot Framework releases.
+    """
+    def parse(path_):
+        with profiler.phase('parse'):
+            try:
+                from robot.api import get_model  # noqa: F401
+            except ImportError:
+                return parse_legacy(path_)
+            if os.path.isdir(path_):
+                return parse_model_directory(path_)
+            return parse_model_file(path_)
+
+    def load(path_):
+        return rendered_sources.get(
+            lambda: ('suite', os.path.realpath(path_),
+                     get_source_hash(path_)),
+            lambda: parse(path_))
+    return parsed_sources.get('suite', path, load)
+
+
+REGEX_CHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+class NameIndex(object):
+    """Lookup index for the test cases or keywords of a parsed source
+
+    Holds the objects in their source order together with a sorted name list
+    (for literal prefix lookups), an exact name dictionary and an inverted
+    tag dictionary, so that directives filtering the same source need not
+    walk and match the whole suite again.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.names = sorted((obj.name, idx) for idx, obj in enumerate(objects))
+        self.exact = {}
+        self.tags = {}
+        for idx, obj in enumerate(objects):
+            self.exact.setdefault(obj.name, set()).add(idx)
+            for tag in obj.tags:
+                self.tags.setdefault(tag, set()).add(idx)
+
+    def match(self, pattern):
+        """Return indexes of the objects with name matching the pattern
+
+        The pattern is matched from the beginning of the name like with
+        ``re.match``. Literal patterns are looked up from the index without
+        evaluating any regular expressions.
+        """
+        if not REGEX_CHARACTERS.search(pattern):
+            start = bisect.bisect_left(self.names, (pattern,))
+            end = bisect.bisect_left(self.names, (pattern + u'\uffff',))
+            return set(idx for name, idx in self.names[start:end])
+        elif pattern.endswith('$') and \
+                not REGEX_CHARACTERS.search(pattern[:-1]):
+            return self.exact.get(pattern[:-1], set())
+        needle = re.compile(pattern, re.U)
+        return set(idx for name, idx in self.names if needle.match(name))
+
+    def tagged(self, tags):
+        """Return indexes of the objects with any of the given tags"""
+        return set().union(*[self.tags.get(tag, set()) for tag in tags])
+
+    def filter(self, pattern, tags=None):
+        """Return objects matching the pattern and tags in source order"""
+        indexes = self.match(pattern)
+        if tags:
+            indexes &= self.tagged(tags)
+        return [self.objects[idx] for idx in sorted(indexes)]
+
+
+def get_test_index(path):
+    """Return cached test case index for the given test suite"""
+    return parsed_sources.get(
+        'test-index', path, lambda path_: NameIndex(parse_source(path_).tests))
+
+
+def get_keyword_index(path):
+    """Return cached user keyword index for the given suite or resource"""
+    return parsed_sources.get(
+        'keyword-index', path,
+        lambda path_: NameIndex(parse_source(path_).keywords))
+
+
+SEPARATOR = re.compile(r' {2,}|\t')
+
+
+def scan_test_names(path):
+    """Return test names of a plain text suite file without parsing it
+
+    Only the first cells of the rows in test case tables are looked at.
+    Returns None for files in formats, or with names, which cannot be
+    scanned reliably.
+    """
+    if os.path.splitext(path)[1].lower() not in TEXT_EXTENSIONS:
+        return None
+    names = []
+    tests = False
+    for line in sources.read(path).splitlines():
+        if line.startswith('| '):
+            line = line[2:]
+            cell = line.split(' |', 1)[0].rstrip()
+        else:
+            cell = SEPARATOR.split(line, 1)[0].rstrip()
+        if line.startswith('*'):
+            tests = SECTION_NAMES.get(
+                cell.replace('*', '').replace(' ', '').lower()) == 'test cases'
+        elif not tests or not cell or line[0].isspace() or \
+                cell.startswith('#') or cell == '...':
+            continue
+        elif '\\' in cell:
+            return None
+        else:
+            names.append(cell)
+    return names
+
+
+def get_test_name_index(path):
+    """Return cached index of scanned test names or None (see above)"""
+    def load(path_):
+        names = scan_test_names(path_)
+        return names is not None and NameIndex(
+            [Test(name) for name in names]) or None
+    return parsed_sources.get('test-names', path, load)
+
+
+def filter_directory_tests(path, pattern, tags=None):
+    """Return tests of a suite directory matching the pattern and tags
+
+    Test names of every suite file are first scanned without parsing and
+    only the files with tests matching the pattern are parsed.
+    """
+    tests = []
+    for filename in get_suite_files(path)[1]:
+        index = get_test_name_index(filename)
+        if index is not None and not index.match(pattern):
+            continue
+        tests.extend(get_test_index(filename).filter(pattern, tags))
+    return tests
+
+
+def tokenize(path):
+    with profiler.phase('highlight'):
+        return list(get_lexer().get_tokens(sources.read(path)))
+
+
+def stream_tokens(path, start=1, end=None):
+    """Yield tokens for the given line range of a Robot source
+
+    Equivalent to the tokens of the robotframework lexer, but the source is
+    read and tokenized one row at a time and is never held in memory as a
+    whole. Rows before the range are only fed to the row tokenizer to keep
+    its table and template state.
+    """
+    from pygments.lexers.robotframework import RowTokenizer
+    from pygments.lexers.robotframework import VariableTokenizer
+    row_tokenizer = RowTokenizer()
+    var_tokenizer = VariableTokenizer()
+    with sources.open(path) as source:
+        for number, line in enumerate(source, 1):
+            if end is not None and number > end:
+                break
+            row = line.rstrip('\r\n').expandtabs(2)
+            if number < start:
+                deque(row_tokenizer.tokenize(row), maxlen=0)
+                continue
+            for value, token in row_tokenizer.tokenize(row):
+                for value, token in var_tokenizer.tokenize(value, token):
+                    if value:
+                        yield token, value
+
+
+def get_tokens(path):
+    """Return cached Pygments token stream for the given Robot source"""
+    return parsed_sources.get('tokens', path, tokenize)
+
+
+SECTION_NAMES = {
+    'setting': 'settings',
+    'settings': 'settings',
+    'metadata': 'settings',
+    'variable': 'variables',
+    'variables': 'variables',
+    'testcase': 'test cases',
+    'testcases': 'test cases',
+    'task': 'test cases',
+    'tasks': 'test cases',
+    'keyword': 'keywords',
+    'keywords': 'keywords',
+    'userkeyword': 'keywords',
+    'userkeywords': 'keywords',
+}
+
+
+def index_sections(tokens):
+    """Return token ranges for the tables in the given token stream
+
+    Tables are found from the Generic.Heading tokens of the robotframework
+    lexer and returned as a dictionary mapping the normalized table names
+    ('settings', 'variables', 'test cases' and 'keywords') to lists of
+    (start, end) token index pairs. Only the first heading of a row starts
+    a table; the other headings of the row are its column names.
+    """
+    from pygments.token import Token
+    sections = {}
+    name = None
+    start = row = None  # first tokens of the table and the current row
+    for idx, (ttype, value) in enumerate(tokens):
+        if row is None:
+            row = idx
+        if ttype is Token.Generic.Heading and row != start:
+            if name is not None:
+                sections.setdefault(name, []).append((start, row))
+            name = SECTION_NAMES.get(
+                value.replace('*', '').replace(' ', '').lower())
+            start = row
+        if value.endswith('\n'):
+            row = None
+    if name is not None:
+        sections.setdefault(name, []).append((start, len(tokens)))
+    return sections
+
+
+def get_sections(path):
+    """Return cached table index for the given Robot source"""
+    def load(path_):
+        return rendered_sources.get(
+            lambda: ('sections', get_source_hash(path_)),
+            lambda: index_sections(get_tokens(path_)))
+    return parsed_sources.get('sections', path, load)
+
+
+def get_section_tokens(path, section):
+    """Return the tokens of the given table of the given Robot source"""
+    tokens = get_tokens(path)
+    return flatten([tokens[start:end] for start, end
+                    in get_sections(path).get(section, [])])
+
+
+def strip_setting(tokens, name):
+    """Return tokens without the given setting and its continuation rows"""
+    from pygments.token import Token
+    result = []
+    skip = False
+    for ttype, value in tokens:
+        if ttype is Token.Keyword.Namespace:
+            skip = value.lower() == name
+        if not skip:
+            result.append((ttype, value))
+    return result
+
+
+def strip_heading(tokens):
+    """Return tokens without the table heading when followed by empty row"""
+    from pygments.token import Token
+    if not tokens or tokens[0][0] is not Token.Generic.Heading:
+        return tokens
+    whitespace = ''
+    for idx, (ttype, value) in enumerate(tokens[1:], 2):
+        whitespace += value
+        if whitespace == '\n\n':
+            return tokens[idx:]
+        elif not '\n\n'.startswith(whitespace):
+            break
+    return tokens
 
 
 def get_title_style(used_styles=None, level=1):
@@ -48,15 +937,305 @@ def get_title_style(used_styles=None, level=1):
 
 
 def get_tags_information(obj, tags):
-    tags_info = ''
+    """Yield setting rows of the given test or keyword in the given order"""
     for tag in tags:
-        tag_object = getattr(obj, tag.lower(), None)
-        if tag_object and len(tag_object.as_list()) > 1:
-            tag_list = tag_object.as_list()
-            tags_info += ' ' * 4 + tag_list[0] + '  ' + '  '.join(
-                tag_list[1:]) + '\n'
+        tag_list = obj.get_setting(tag)
+        if tag_list and len(tag_list) > 1:
+            yield ' ' * 4 + tag_list[0] + '  ' + '  '.join(tag_list[1:])
 
-    return tags_info
+
+def get_step_lines(steps):
+    """Yield text rows for the given flattened steps
+
+    Block bodies are indented by their level and Gherkin style When, Then and
+    And steps are aligned with the keyword after Given.
+    """
+    for step in steps:
+        prefix = ' ' * 4 * step.level
+        value = '  '.join(step.cells)
+        if value.startswith('When ') or value.startswith('Then '):
+            prefix = ' ' + prefix
+        elif value.startswith('And '):
+            prefix = '  ' + prefix
+        yield ' ' * 4 + prefix + value
+
+
+# Data rows shown by default for data-driven tests in the summary style
+SUMMARY_ROWS = 10
+
+
+def get_code(table, obj, tags=None, max_rows=None):
+    """Return Robot code of the given test or keyword under the table name
+
+    With ``max_rows`` only the first rows of the steps are included followed
+    by a comment row with the number of the omitted rows.
+    """
+    lines = ['***%s***' % table, '', obj.name]
+    if tags is not None:
+        lines.extend(get_tags_information(obj, tags))
+    lines.extend(get_step_lines(obj.steps[:max_rows]))
+    if max_rows is not None and len(obj.steps) > max_rows:
+        lines.append('    # ... %d more rows, %d in total' % (
+            len(obj.steps) - max_rows, len(obj.steps)))
+    return '\n'.join(lines) + '\n'
+
+
+def get_data_columns(obj):
+    """Return column names for the data rows of a data-driven test"""
+    width = max([len(step.cells) for step in obj.steps] +
+                [len(obj.columns)])
+    return list(obj.columns) + ['Argument %d' % idx for idx
+                                in range(len(obj.columns) + 1, width + 1)]
+
+
+def get_data_summary(obj, max_rows):
+    """Return nodes summarizing the data rows of a data-driven test"""
+    template = addnodes.pending_xref(
+        '', nodes.literal(text=obj.template), refdomain='robot',
+        reftype='kw', reftarget=obj.template, refexplicit=False,
+        refwarn=False)
+    result = [nodes.paragraph('', '', nodes.Text('Template '), template,
+                              nodes.Text(', %d of %d rows.' % (
+                                  min(max_rows, len(obj.steps)),
+                                  len(obj.steps))))]
+    if obj.steps:
+        columns = get_data_columns(obj)
+        result.append(get_table(columns, [
+            [nodes.Text(cell) for cell in step.cells] +
+            [nodes.Text('')] * (len(columns) - len(step.cells))
+            for step in obj.steps[:max_rows]]))
+    return result
+
+
+def get_data_csv(obj):
+    """Return the data rows of a data-driven test as CSV"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(get_data_columns(obj))
+    for step in obj.steps:
+        writer.writerow(step.cells)
+    return output.getvalue()
+
+
+class robot_code(nodes.General, nodes.Element):
+    """Format-neutral placeholder for syntax highlighted Robot code
+
+    The node holds either a hash of the code to highlight (``snippet``),
+    which is stored once into the environment by :func:`add_snippet`, or
+    the path of a Robot source (``source``) with an optional table name
+    (``section``). It is rendered into a raw node for the format of the
+    active builder only by :class:`RobotCodeRenderer`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(robot_code, self).__init__(*args, **kwargs)
+        if profiler.current is not None:
+            # Render time is added to the record of the creating directive
+            self['profile'] = profiler.current['id']
+
+
+class robot_data(nodes.General, nodes.Element):
+    """Placeholder for a download of the data rows of a data-driven test
+
+    The node holds a hash of the CSV data (``snippet``) stored by
+    :func:`add_snippet` and the number of the data rows (``rows``).
+    """
+
+
+def add_snippet(directive, code):
+    """Store code into the environment once and return its hash"""
+    env = directive.state.document.settings.env
+    digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+    if not hasattr(env, 'robotdoc_snippets'):
+        env.robotdoc_snippets = {}
+    env.robotdoc_snippets[digest] = code
+    return digest
+
+
+def get_snippet_id(node):
+    """Return identifier of the content rendered for the given node"""
+    if node.get('snippet') is not None:
+        return node['snippet']
+    return hashlib.sha1(repr((
+        os.path.realpath(node['source']), node.get('section'),
+        node.get('style', 'default'), node.get('lines'))
+    ).encode('utf-8')).hexdigest()
+
+
+lexers = {}
+formatters = {}
+
+
+def get_lexer():
+    """Return the shared robotframework lexer"""
+    if 'robotframework' not in lexers:
+        from pygments.lexers import get_lexer_by_name
+        lexers['robotframework'] = get_lexer_by_name('robotframework')
+    return lexers['robotframework']
+
+
+def get_formatter(fmt):
+    """Return the shared Pygments formatter for the given output format"""
+    if fmt not in formatters:
+        if fmt == 'html':
+            from pygments.formatters import HtmlFormatter
+            formatters[fmt] = HtmlFormatter(noclasses=False)
+        else:
+            from pygments.formatters import LatexFormatter
+            formatters[fmt] = LatexFormatter()
+    return formatters[fmt]
+
+
+# Substitutions removing table and test case or keyword headings from the
+# highlighted steps in the default style
+DEFAULT_STYLE_PATTERNS = {
+    'html': [
+        (re.compile(r'<span class="gh">[^\n]+\n\n'), ''),
+        (re.compile(r'<span class="gu">[^<]+</span>'), ''),
+        (re.compile(r'<pre><span class="p"></span>'), '<pre>'),
+        (re.compile(r'<span class="p">    '), '<span class="p">'),
+    ],
+    'latex': [
+        (re.compile(r'\\PY{g\+gh}{[^}]+}\n\n'), ''),
+        (re.compile(r'\\PY{g\+gu}{[^}]+}\n'), ''),
+    ],
+}
+
+
+def render_code(node, fmt):
+    """Return highlighted output of the given robot_code node"""
+    from pygments import format as format_tokens
+    from pygments import highlight
+    style_ = node.get('style', 'default')
+    formatter = get_formatter(fmt)
+
+    if node.get('code') is not None:
+        parsed = highlight(node['code'], get_lexer(), formatter)
+        if style_ == 'default':
+            for pattern, replacement in DEFAULT_STYLE_PATTERNS[fmt]:
+                parsed = pattern.sub(replacement, parsed)
+        return parsed
+
+    if node.get('stream'):
+        return format_tokens(
+            stream_tokens(node['source'], *(node.get('lines') or [1])),
+            formatter)
+
+    if node.get('section'):
+        tokens = get_section_tokens(node['source'], node['section'])
+    else:
+        tokens = get_tokens(node['source'])
+    if node.get('section') == 'settings':
+        # Documentation is rendered separately as reStructuredText
+        tokens = strip_setting(tokens, 'documentation')
+    if node.get('section') and style_ == 'default':
+        tokens = strip_heading(tokens)
+    return format_tokens(tokens, formatter)
+
+
+class RobotCodeRenderer(SphinxPostTransform):
+    """Render robot_code nodes for the format of the active builder"""
+    default_priority = 200
+
+    def run(self, **kwargs):
+        fmt = self.app.builder.format
+        for node in list(self.document.findall(robot_code)):
+            if fmt in ('html', 'latex'):
+                with profiler.record(get_profile_record(self.env, node)):
+                    output = self.render(node, fmt)
+                    if fmt == 'html':
+                        output = self.share(node, output)
+                    node.replace_self(nodes.raw('', output, format=fmt))
+            else:
+                node.parent.remove(node)
+        for node in list(self.document.findall(robot_data)):
+            if fmt == 'html':
+                node.replace_self(self.download(node))
+            else:
+                node.parent.remove(node)
+
+    def download(self, node):
+        """Return reference to the data rows written into a CSV file"""
+        from sphinx.util.osutil import relative_uri
+        filename = 'robotdoc/%s.csv' % node['snippet']
+        path = os.path.join(self.app.outdir, '_static', filename)
+        if not os.path.exists(path):
+            write_file(path, self.env.robotdoc_snippets[node['snippet']])
+        uri = relative_uri(self.app.builder.get_target_uri(self.env.docname),
+                           '_static/' + filename)
+        return nodes.paragraph('', '', nodes.reference(
+            '', 'Download all %d rows (CSV)' % node['rows'], refuri=uri))
+
+    def render(self, node, fmt):
+        """Return rendered output, rendering each snippet once per build"""
+        if node.get('snippet') is not None:
+            digest = node['snippet']
+            node['code'] = self.env.robotdoc_snippets[digest]
+        elif node.get('code') is not None:
+            digest = hashlib.sha1(node['code'].encode('utf-8')).hexdigest()
+        else:
+            digest = get_source_hash(node['source'])
+        key = ('render', fmt, digest, node.get('section'),
+               node.get('style', 'default'), tuple(node.get('lines') or ()))
+        with profiler.phase('highlight'):
+            return parsed_sources.lookup(key, None, None, lambda: (
+                rendered_sources.get(key, lambda: render_code(node, fmt))))
+
+    def share(self, node, output):
+        """Return reference to a shared static file for repeated output
+
+        Output of at least ``robotdoc_shared_snippet_size`` characters
+        embedded more than once in the documentation is written once into
+        ``_static/robotdoc/`` and loaded into the pages by ``robotdoc.js``.
+        """
+        threshold = self.config.robotdoc_shared_snippet_size
+        if not threshold or len(output) < threshold or \
+                getattr(self.env, 'robotdoc_snippet_counts', {}).get(
+                    get_snippet_id(node), 0) < 2:
+            return output
+        from sphinx.util.osutil import relative_uri
+        filename = 'robotdoc/%s.html' % hashlib.sha1(
+            output.encode('utf-8')).hexdigest()
+        path = os.path.join(self.app.outdir, '_static', filename)
+        if not os.path.exists(path):
+            write_file(path, output)
+        uri = relative_uri(self.app.builder.get_target_uri(self.env.docname),
+                           '_static/' + filename)
+        return ('<div class="robotdoc-snippet" data-src="%s">'
+                '<a href="%s">%s</a></div>\n' % (uri, uri, filename))
+
+
+def write_file(path, text):
+    """Write text atomically, as parallel writers may write the same file"""
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:  # created by a parallel process
+            pass
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with io.open(fd, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+    # mkstemp creates files readable only by the owner
+    os.chmod(temp, 0o666 & ~get_umask())
+    os.replace(temp, path)
+
+
+def get_umask():
+    """Return the umask of the process"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def get_profile_record(env, node):
+    """Return the profile record of the directive which created the node"""
+    if not profiler.enabled or 'profile' not in node:
+        return None
+    docname, idx = node['profile']
+    try:
+        return env.robotdoc_profile[docname][idx]
+    except (AttributeError, KeyError, IndexError):
+        return None
 
 
 class Adapter(object):
@@ -75,153 +1254,306 @@ class Adapter(object):
         cls.registry[klass] = adapter
 
 
-class StepNode(Adapter):
-    def __init__(self, context, prefix=''):
-        super(StepNode, self).__init__(context)
-        self.prefix = prefix
-
-    def __call__(self, obj):
-        prefix = self.prefix
-        value = '  '.join(obj.as_list())
-        if value.startswith('When ') or value.startswith('Then '):
-            prefix = ' ' + prefix
-        elif value.startswith('And '):
-            prefix = '  ' + prefix
-        return [nodes.inline(text=prefix + value)]
-
+TITLE_ADORNMENT = re.compile(r'^([!-/:-@[-`{-~])\1+\s*$', re.M)
 
-Adapter.register(robot.parsing.model.Step, StepNode)
 
+def get_section_level(state):
+    """Return the number of the sections containing the directive
 
-class ForLoopNode(Adapter):
-    def __call__(self, obj):
-        all_steps = [x for x in obj.steps if not x.is_comment()]
-        return StepNode(self.context)(obj) + flatten(
-            list(map(Adapter(self.context, '\\    '), all_steps)))
+    The level is counted from the node tree, because ``memo.section_level``
+    is no longer maintained by docutils 0.22.
+    """
+    level = 0
+    node = state.parent
+    while node is not None:
+        if isinstance(node, nodes.section):
+            level += 1
+        node = node.parent
+    return level
 
 
-Adapter.register(robot.parsing.model.ForLoop, ForLoopNode)
+def nested_parse_sections(context, source, node):
+    """Parse reStructuredText with titles into the given node"""
+    memo = context.state.memo
+    section_level = memo.section_level
+    lines = statemachine.string2lines(source)
+    with profiler.phase('nested_parse'):
+        try:
+            context.state.nested_parse(
+                statemachine.StringList(
+                    lines, context.state.document.current_source),
+                context.content_offset,
+                node, match_titles=True
+            )
+        finally:
+            memo.section_level = section_level
+
+
+def get_documentation_source(context, obj):
+    """Return reStructuredText section for the given test or keyword"""
+    used_title_styles = context.state.memo.title_styles
+    section_level = get_section_level(context.state) + 1
+    title_style = get_title_style(used_title_styles, section_level)
+    title = obj.name + '\n' + title_style * len(obj.name) + '\n\n'
+    documentation = obj.doc.replace('\\n', '\n')  # fix linebreaks
+    documentation = documentation.replace('\\t', '    ')  # fix tabs
+    return title + documentation
+
+
+def parse_documentation(context, objects):
+    """Return documentation sections for the given tests or keywords
+
+    Documentation for all the objects is parsed with a single nested parse.
+    Objects with documentation that may contain titles of its own, which
+    would make the resulting sections ambiguous, are parsed separately.
+    """
+    sources = [get_documentation_source(context, obj) for obj in objects]
+    batch = [not TITLE_ADORNMENT.search(source.split('\n', 2)[-1])
+             for source in sources]
+
+    temp = nodes.Element()
+    if any(batch):
+        nested_parse_sections(context, '\n\n'.join(
+            [source for source, batch_ in zip(sources, batch) if batch_]),
+            temp)
+    if len(temp.children) != batch.count(True) or not all(
+            [isinstance(child, nodes.section) for child in temp.children]):
+        # Titles were not recognized as expected; parse each separately
+        batch = [False] * len(sources)
+    batched = iter(temp.children[:])
+
+    sections = []
+    for obj, source, batch_ in zip(objects, sources, batch):
+        if batch_:
+            sections.append(next(batched))
+            continue
+        temp = nodes.Element()
+        nested_parse_sections(context, source, temp)
+        if temp.children and isinstance(temp.children[-1], nodes.section):
+            sections.append(temp.children.pop())
+        else:
+            # The title was rejected; keep the parsed content with messages
+            section = nodes.section(
+                '', nodes.title(text=obj.name), *temp.children,
+                names=[nodes.fully_normalize_name(obj.name)])
+            context.state.document.note_implicit_target(section, section)
+            sections.append(section)
+    return sections
 
 
 class TestCaseNode(Adapter):
-    TAGS_LIST = ["setup", "teardown", "tags", "documentation", "template",
-                 "timeout"]
-
-    def __call__(self, obj):
-
-        used_title_styles = self.context.state.memo.title_styles
-        section_level = self.context.state.memo.section_level + 1
-        title_style = get_title_style(used_title_styles, section_level)
-        title = obj.name + '\n' + title_style * len(obj.name) + '\n\n'
-        documentation = obj.doc.value.replace('\\n', '\n')  # fix linebreaks
-        documentation = documentation.replace('\\t', '    ')  # fix tabs
+    TAGS_LIST = ["setup", "teardown", "tags", "template", "timeout"]
 
-        temp = nodes.Element()
-        lines = statemachine.string2lines(title + documentation)
-        self.context.content.data = lines
-        self.context.state.nested_parse(
-            self.context.content,
-            self.context.content_offset,
-            temp, match_titles=True
-        )
+    def __init__(self, context, section=None):
+        super(TestCaseNode, self).__init__(context)
+        self.section = section
 
-        node = temp.children.pop()
+    def __call__(self, obj):
+        if self.section is None:
+            node = parse_documentation(self.context, [obj])[0]
+        else:
+            node = self.section
+        note_object(self.context, 'test', obj, node)
 
-        if self.context.options.get('style', 'default') == 'minimal':
+        style_ = self.context.options.get('style', 'default')
+        if style_ == 'minimal':
             return [node]
 
-        tags_info = get_tags_information(obj,
-                                         TestCaseNode.TAGS_LIST) if self.context.options.get(
-            'style', 'default') == "expanded" else ''
-
-        all_steps = [x for x in obj.steps if not x.is_comment()]
-
-        steps = '***Test Cases***\n\n%s\n' % obj.name
-        steps += tags_info
-        for step in flatten(list(map(Adapter(self.context), all_steps))):
-            steps += ' ' * 4 + step.astext() + '\n'
-
-        lexer = get_lexer_by_name('robotframework')
-        formatter = HtmlFormatter(noclasses=False)
-        parsed = highlight(steps, lexer, formatter)
-        if self.context.options.get('style', 'default') == 'default':
-            parsed = re.sub('<span class="gh">[^\n]+\n\n', '', parsed)
-            parsed = re.sub('<span class="gu">[^<]+</span>', '', parsed)
-            parsed = re.sub('<pre><span class="p"></span>', '<pre>', parsed)
-            parsed = re.sub('<span class="p">    ', '<span class="p">', parsed)
-        node.append(nodes.raw('', parsed, format='html'))
-
-        formatter = LatexFormatter()
-        parsed = highlight(steps, lexer, formatter)
-        if self.context.options.get('style', 'default') == 'default':
-            parsed = re.sub('\\\PY{g\+gh}{[^}]+}\n\n', '', parsed)
-            parsed = re.sub('\\\PY{g\+gu}{[^}]+}\n', '', parsed)
-        node.append(nodes.raw('', parsed, format='latex'))
+        max_rows = self.context.options.get('max-rows')
+        if style_ == 'summary' and max_rows is None and \
+                obj.template is not None:
+            max_rows = SUMMARY_ROWS
+
+        if style_ == 'summary' and obj.template is not None:
+            node.extend(get_data_summary(obj, max_rows))
+        elif style_ == 'expanded':
+            steps = get_code('Test Cases', obj, TestCaseNode.TAGS_LIST,
+                             max_rows)
+            node.append(robot_code(
+                '', snippet=add_snippet(self.context, steps), style=style_))
+        else:
+            steps = get_code('Test Cases', obj, max_rows=max_rows)
+            node.append(robot_code(
+                '', snippet=add_snippet(self.context, steps),
+                style='default'))
+
+        if 'data-download' in self.context.options and \
+                obj.template is not None:
+            node.append(robot_data(
+                '', snippet=add_snippet(self.context, get_data_csv(obj)),
+                rows=len(obj.steps)))
 
         return [node]
 
 
-Adapter.register(robot.parsing.model.TestCase, TestCaseNode)
+Adapter.register(Test, TestCaseNode)
 
 
 class UserKeywordNode(Adapter):
-    TAGS_LIST = ["docs", "args", "return_", "teardown", "timeout"]
+    TAGS_LIST = ["arguments", "return", "teardown", "timeout"]
 
-    def __call__(self, obj):
-
-        used_title_styles = self.context.state.memo.title_styles
-        section_level = self.context.state.memo.section_level + 1
-        title_style = get_title_style(used_title_styles, section_level)
-        title = obj.name + '\n' + title_style * len(obj.name) + '\n\n'
-        documentation = obj.doc.value.replace('\\n', '\n')  # fix linebreaks
-        documentation = documentation.replace('\\t', '    ')  # fix tabs
-
-        temp = nodes.Element()
-        lines = statemachine.string2lines(title + documentation)
-        self.context.content.data = lines
-        self.context.state.nested_parse(
-            self.context.content,
-            self.context.content_offset,
-            temp, match_titles=True
-        )
+    def __init__(self, context, section=None):
+        super(UserKeywordNode, self).__init__(context)
+        self.section = section
 
-        node = temp.children.pop()
+    def __call__(self, obj):
+        if self.section is None:
+            node = parse_documentation(self.context, [obj])[0]
+        else:
+            node = self.section
+        note_object(self.context, 'keyword', obj, node)
 
         if self.context.options.get('style', 'default') == 'minimal':
             return [node]
 
-        tags_info = get_tags_information(obj,
-                                         UserKeywordNode.TAGS_LIST) if self.context.options.get(
-            'style', 'default') == "expanded" else ''
-
-        all_steps = [x for x in obj.steps if not x.is_comment()]
-
-        steps = '***Keywords***\n\n%s\n' % obj.name
-        steps += tags_info
-        for step in flatten(list(map(Adapter(self.context), all_steps))):
-            steps += ' ' * 4 + step.astext() + '\n'
-
-        lexer = get_lexer_by_name('robotframework')
-        formatter = HtmlFormatter(noclasses=False)
-        parsed = highlight(steps, lexer, formatter)
-        if self.context.options.get('style', 'default') == 'default':
-            parsed = re.sub('<span class="gh">[^\n]+\n\n', '', parsed)
-            parsed = re.sub('<span class="gu">[^<]+</span>', '', parsed)
-            parsed = re.sub('<pre><span class="p"></span>', '<pre>', parsed)
-            parsed = re.sub('<span class="p">    ', '<span class="p">', parsed)
-        node.append(nodes.raw('', parsed, format='html'))
-
-        formatter = LatexFormatter()
-        parsed = highlight(steps, lexer, formatter)
-        if self.context.options.get('style', 'default') == 'default':
-            parsed = re.sub('\\\PY{g\+gh}{[^}]+}\n\n', '', parsed)
-            parsed = re.sub('\\\PY{g\+gu}{[^}]+}\n', '', parsed)
-        node.append(nodes.raw('', parsed, format='latex'))
+        if self.context.options.get('style', 'default') == 'expanded':
+            steps = get_code('Keywords', obj, UserKeywordNode.TAGS_LIST)
+        else:
+            steps = get_code('Keywords', obj)
+
+        node.append(robot_code(
+            '', snippet=add_snippet(self.context, steps),
+            style=self.context.options.get('style', 'default')))
 
         return [node]
 
 
-Adapter.register(robot.parsing.model.UserKeyword, UserKeywordNode)
+Adapter.register(Keyword, UserKeywordNode)
+
+
+def normalize_name(name):
+    """Normalize test or keyword name like Robot Framework matches them"""
+    return name.lower().replace(' ', '').replace('_', '')
+
+
+def note_object(directive, objtype, obj, section):
+    """Add a stable anchor for the test or keyword and register it
+
+    Anchors are made of the object type, the source file name and the
+    object name, e.g. 'robot-keyword-resource-my-keyword'.
+    """
+    document = directive.state.document
+    env = document.settings.env
+    stem = os.path.splitext(os.path.basename(obj.source or ''))[0]
+    anchor = nodes.make_id('robot-%s-%s-%s' % (objtype, stem, obj.name))
+    if anchor not in document.ids:
+        section['ids'].append(anchor)
+        document.ids[anchor] = section
+    if anchor in section['ids']:
+        env.get_domain('robot').note_object(
+            objtype, obj.name, stem, env.docname, anchor)
+        if env.config.robotdoc_search_index:
+            note_search_entry(env, objtype, obj, anchor)
+
+
+def note_search_entry(env, objtype, obj, anchor):
+    """Add the test or keyword into the search index of the document"""
+    if not hasattr(env, 'robotdoc_search'):
+        env.robotdoc_search = {}
+    arguments = obj.get_setting('arguments') or ()
+    env.robotdoc_search.setdefault(env.docname, []).append([
+        objtype, obj.name, list(arguments[1:]), list(obj.tags),
+        os.path.basename(obj.source or ''), anchor])
+
+
+class RobotDomain(Domain):
+    """Robot Framework domain for the embedded tests and keywords
+
+    Objects are stored by their type and normalized name, both plain and
+    qualified with the source file name (``resource.Keyword Name``), with
+    every document embedding them. References resolve to the first of the
+    documents by name for the result not to depend on read order.
+    """
+    name = 'robot'
+    label = 'Robot Framework'
+    object_types = {
+        'keyword': ObjType('keyword', 'kw'),
+        'test': ObjType('test', 'test'),
+    }
+    roles = {
+        'kw': XRefRole(),
+        'test': XRefRole(),
+    }
+    initial_data = {
+        # (objtype, normalized name) -> {docname: (anchor, name)}
+        'objects': {},
+    }
+    data_version = 2
+
+    def note_object(self, objtype, name, stem, docname, anchor):
+        for name_ in (name, stem and '%s.%s' % (stem, name)):
+            if not name_:
+                continue
+            locations = self.data['objects'].setdefault(
+                (objtype, normalize_name(name_)), {})
+            if docname not in locations or \
+                    anchor < locations[docname][0]:
+                locations[docname] = (anchor, name_)
+
+    def get_location(self, objtype, target):
+        """Return (docname, anchor, name) of the object or None"""
+        locations = self.data['objects'].get(
+            (objtype, normalize_name(target)))
+        if not locations:
+            return None
+        docname = min(locations)
+        return (docname,) + tuple(locations[docname])
+
+    def clear_doc(self, docname):
+        for key, locations in list(self.data['objects'].items()):
+            locations.pop(docname, None)
+            if not locations:
+                del self.data['objects'][key]
+
+    def merge_domaindata(self, docnames, otherdata):
+        for key, locations in otherdata['objects'].items():
+            for docname, location in locations.items():
+                if docname in docnames:
+                    self.data['objects'].setdefault(
+                        key, {})[docname] = location
+
+    def resolve_xref(self, env, fromdocname, builder, typ, target, node,
+                     contnode):
+        for objtype in self.objtypes_for_role(typ) or []:
+            entry = self.get_location(objtype, target)
+            if entry is not None:
+                return make_refnode(builder, fromdocname, entry[0], entry[1],
+                                    contnode, entry[2])
+        return None
+
+    def resolve_any_xref(self, env, fromdocname, builder, target, node,
+                         contnode):
+        results = []
+        for objtype in self.object_types:
+            entry = self.get_location(objtype, target)
+            if entry is not None:
+                results.append((
+                    'robot:' + self.role_for_objtype(objtype),
+                    make_refnode(builder, fromdocname, entry[0], entry[1],
+                                 contnode, entry[2])))
+        return results
+
+    def get_objects(self):
+        for objtype, key in self.data['objects']:
+            docname, anchor, name = self.get_location(objtype, key)
+            yield name, name, objtype, docname, anchor, 1
+
+
+def line_range(argument):
+    """Parse line range 'START-END', 'START-', '-END' or 'LINE'"""
+    match = re.match(r'^\s*(\d*)\s*(-?)\s*(\d*)\s*$', argument or '')
+    if not match or not (match.group(1) or match.group(3)):
+        raise ValueError('invalid line range "%s"' % argument)
+    start = int(match.group(1) or 1)
+    if match.group(3):
+        end = int(match.group(3))
+    elif match.group(2):
+        end = None
+    else:
+        end = start
+    if start < 1 or (end is not None and end < start):
+        raise ValueError('invalid line range "%s"' % argument)
+    return [start, end]
 
 
 def style(argument):
@@ -232,6 +1564,12 @@ def style(argument):
         return 'default'
 
 
+def test_style(argument):
+    if (argument or '').strip() == 'summary':
+        return 'summary'
+    return style(argument)
+
+
 class SourceDirective(Directive):
     """Robot  directive"""
     has_content = False
@@ -239,27 +1577,33 @@ class SourceDirective(Directive):
     option_spec = {
         'source': directives.path,
         'suite': directives.path,  # alias for 'source'
+        'lines': line_range,
+        'max-lines': directives.positive_int,
     }
 
+    @profiled
     def run(self):
         path = resolve_path(
             self.options.get('source', self.options.get('suite')),
             os.path.dirname(self.state.document.current_source)
         )
-
-        lexer = get_lexer_by_name('robotframework')
-
-        with open(path, 'r') as source:
-            formatter = HtmlFormatter(noclasses=False)
-            parsed = highlight(source.read(), lexer, formatter)
-        html_node = nodes.raw('', parsed, format='html')
-
-        with open(path, 'r') as source:
-            formatter = LatexFormatter()
-            parsed = highlight(source.read(), lexer, formatter)
-        latex_node = nodes.raw('', parsed, format='latex')
-
-        return [html_node, latex_node]
+        note_source(self, path)
+
+        lines = self.options.get('lines')
+        if 'max-lines' in self.options:
+            start, end = lines or [1, None]
+            limit = start + self.options['max-lines'] - 1
+            lines = [start, end is None and limit or min(end, limit)]
+
+        # Huge sources and line ranges are tokenized and rendered as a stream
+        # instead of caching the tokens of the whole source
+        config = self.state.document.settings.env.config
+        if lines is not None:
+            return [robot_code('', source=path, stream=True, lines=lines)]
+        elif os.path.getsize(path) > config.robotdoc_stream_size:
+            return [robot_code('', source=path, stream=True)]
+        else:
+            return [robot_code('', source=path)]
 
 
 class SettingsDirective(Directive):
@@ -273,6 +1617,7 @@ class SettingsDirective(Directive):
         'style': style
     }
 
+    @profiled
     def run(self):
         path = resolve_path(
             self.options.get('source', self.options.get('suite',
@@ -281,102 +1626,33 @@ class SettingsDirective(Directive):
                              ),
             os.path.dirname(self.state.document.current_source)
         )
+        note_source(self, path)
 
-        try:
-            resource = robot.parsing.TestData(source=path)
-        except robot.errors.DataError:
-            resource = robot.parsing.ResourceFile(source=path)
-            resource.populate()
-
-        obj = resource.setting_table
-        documentation = obj.doc.value.replace('\\n', '\n')  # fix linebreaks
+        documentation = parse_source(path).doc.replace(
+            '\\n', '\n')  # fix linebreaks
         documentation = documentation.replace('\\t', '    ')  # fix tabs
 
         temp = nodes.Element()
         lines = statemachine.string2lines(documentation)
-        self.content.data = lines
-        self.state.nested_parse(
-            self.content,
-            self.content_offset,
-            temp, match_titles=True
-        )
+        with profiler.phase('nested_parse'):
+            self.state.nested_parse(
+                statemachine.StringList(
+                    lines, self.state.document.current_source),
+                self.content_offset,
+                temp, match_titles=True
+            )
 
         if temp.children:
             doc_node_list = temp.children[:]
         else:
             doc_node_list = []
-        lexer = get_lexer_by_name('robotframework')
-
-        with open(path, 'r') as source:
-            formatter = HtmlFormatter(noclasses=False)
-            parsed = highlight(source.read(), lexer, formatter)
-
-        # Remove everything after the settings table
-        removable_sections = ['Variables', 'Test Cases', 'Keywords']
-        for section in removable_sections:
-            regex = re.compile(
-                '<span class="gh">\*\*\* %s \*\*\*</span>.*</pre>' % section,
-                re.I + re.S + re.M
-            )
-            parsed = regex.sub('</pre>', parsed)
-        parsed = re.sub('<span class="p"></span>\n\n</pre>', '</pre>', parsed)
-
-        # Remove documentation from the settings table
-        if parsed.find('<span class="kn">Documentation') >= 0:
-            start = parsed.find('<span class="kn">Documentation')
-            if parsed[start + 30:].find('<span class="kn">') >= 0:
-                end = parsed[start + 30:].find('<span class="kn">') + 30
-            else:
-                end = parsed[start:].find('</pre>')
-            parsed = parsed[:start] + parsed[start + end:]
-
-        # Remove heading from the settings table when required
-        if self.options.get('style', 'default') == 'default':
-            parsed = re.sub('<span class="gh">[^\n]+\n\n', '', parsed)
-
-        html_settings_node = nodes.raw('', parsed, format='html')
-
-        with open(path, 'r') as source:
-            formatter = LatexFormatter()
-            parsed = highlight(source.read(), lexer, formatter)
-
-        # Remove everything after the settings table
-        removable_sections = ['Variables', 'Test Cases', 'Keywords']
-        for section in removable_sections:
-            regex = re.compile(
-                '\\\PY{g\+gh}{\*\*\* %s \*\*\*}.*\\\end{Verbatim}\n*$' % (
-                    section),
-                re.I + re.S + re.M
-            )
-            parsed = regex.sub('\\\end{Verbatim}\n', parsed)
-
-        # Remove documentation from the settings table
-        if parsed.find('\\PY{k+kn}{Documentation}') >= 0:
-            start = parsed.find('\\PY{k+kn}{Documentation}')
-            if parsed[start + 24:].find('\PY{k+kn}') >= 0:
-                end = parsed[start + 24:].find('\PY{k+kn}') + 24
-            else:
-                end = parsed[start:].find('\\end{Verbatim}')
-            parsed = parsed[:start] + parsed[start + end:]
 
-        # Remove heading from the settings table when required
-        if self.options.get('style', 'default') == 'default':
-            parsed = re.sub('\\\PY{g\+gh}{[^}]+}\n\n', '', parsed)
-            parsed = re.sub('\\\PY{g\+gu}{[^}]+}\n', '', parsed)
+        if 'settings' not in get_sections(path):
+            return doc_node_list
 
-        latex_settings_node = nodes.raw('', parsed, format='latex')
-
-        if len(doc_node_list) > 0:
-            out = []
-
-            for node in doc_node_list:
-                out.append(node)
-            out.append(html_settings_node)
-            out.append(latex_settings_node)
-
-            return out
-        else:
-            return [html_settings_node, latex_settings_node]
+        return doc_node_list + [robot_code(
+            '', source=path, section='settings',
+            style=self.options.get('style', 'default'))]
 
 
 class VariablesDirective(Directive):
@@ -390,6 +1666,7 @@ class VariablesDirective(Directive):
         'style': style
     }
 
+    @profiled
     def run(self):
         path = resolve_path(self.options.get('source',
                                              self.options.get('suite',
@@ -398,61 +1675,13 @@ class VariablesDirective(Directive):
                                              ),
                             os.path.dirname(self.state.document.current_source)
                             )
+        note_source(self, path)
 
-        with open(path, 'r') as source:
-            lexer = get_lexer_by_name('robotframework')
-            formatter = HtmlFormatter(noclasses=False)
-            parsed = highlight(source.read(), lexer, formatter)
-
-        # Remove everything but the variables table
-        removable_sections = ['Test Cases', 'Keywords']
-        regex = re.compile(
-            '(<pre>).*(<span class="gh">\*\*\* Variables \*\*\*</span>)',
-            re.I + re.S + re.M
-        )
-        parsed = regex.sub('\\1\\2', parsed)
-        for section in removable_sections:
-            regex = re.compile(
-                '<span class="gh">\*\*\* %s \*\*\*</span>.*</pre>' % section,
-                re.I + re.S + re.M
-            )
-            parsed = regex.sub('</pre>', parsed)
-        parsed = re.sub('<span class="p"></span>\n\n</pre>', '</pre>', parsed)
-
-        # Remove heading from the variables table when required
-        if self.options.get('style', 'default') == 'default':
-            parsed = re.sub('<span class="gh">[^\n]+\n\n', '', parsed)
-
-        html_variables_node = nodes.raw('', parsed, format='html')
-
-        with open(path, 'r') as source:
-            formatter = LatexFormatter()
-            parsed = highlight(source.read(), lexer, formatter)
-
-        # Remove everything but the variables table
-        removable_sections = ['Test Cases', 'Keywords']
-        regex = re.compile(
-            '(\\\\begin{Verbatim}\[[^\]]*\]\n).*'
-            '(\\\\PY{g\+gh}{\*\*\*\sVariables\s\*\*\*})',
-            re.I + re.S + re.M
-        )
-        parsed = regex.sub('\\1\\2', parsed)
-        for section in removable_sections:
-            regex = re.compile(
-                '\\\PY{g\+gh}{\*\*\* %s \*\*\*}.*\\\end{Verbatim}\n*$' % (
-                    section),
-                re.I + re.S + re.M
-            )
-            parsed = regex.sub('\\\end{Verbatim}\n', parsed)
-
-        # Remove heading from the settings table when required
-        if self.options.get('style', 'default') == 'default':
-            parsed = re.sub('\\\PY{g\+gh}{[^}]+}\n\n', '', parsed)
-            parsed = re.sub('\\\PY{g\+gu}{[^}]+}\n', '', parsed)
-
-        latex_variables_node = nodes.raw('', parsed, format='latex')
+        if 'variables' not in get_sections(path):
+            return []
 
-        return [html_variables_node, latex_variables_node]
+        return [robot_code('', source=path, section='variables',
+                           style=self.options.get('style', 'default'))]
 
 
 class TestCasesDirective(Directive):
@@ -463,44 +1692,38 @@ class TestCasesDirective(Directive):
         'source': directives.path,
         'suite': directives.path,  # alias for 'source'
         'tags': directives.unchanged,
-        'style': style
+        'style': test_style,
+        'max-rows': directives.positive_int,
+        'data-download': directives.flag,
     }
 
+    @profiled
     def run(self):
         path = resolve_path(
             self.options.get('source', self.options.get('suite')),
             os.path.dirname(self.state.document.current_source)
         )
-
-        suite = robot.parsing.TestData(source=path)
+        note_source(self, path)
 
         if self.content:
-            needle = re.compile(self.content[0].strip(), re.U)
+            pattern = self.content[0].strip()
         else:
-            needle = re.compile('.*', re.U)
-
-        tests = []
-        suite_parent = os.path.dirname(path)
-
-        # 1) Recurse through the test suite and filter tests by name
-        def recurse(child_suite, suite_parent):
-            tests.extend([x for x in child_suite.testcase_table.tests if needle.match(x.name)])
+            pattern = ''
 
-            for grandchild in getattr(child_suite, 'children', []):
-                recurse(grandchild, suite_parent)
-
-        recurse(suite, suite_parent)
-
-        # 2) When tags option is set, filter the found tests by given tags
+        # Filter tests by name and, when tags option is set, by given tags
         tags = self.options.get('tags', '').split(',')
         tags = [x.strip() for x in tags]
         tags = [x for x in tags if bool(x)]
-        tag_filter = lambda x: [y for y in [tag in x.tags.value for tag in tags] if bool(y)]
 
-        tests = [x for x in tests if tag_filter(x)] if tags else tests
+        with profiler.phase('filter'):
+            if os.path.isdir(path):
+                tests = filter_directory_tests(path, pattern, tags)
+            else:
+                tests = get_test_index(path).filter(pattern, tags)
 
         # Finally, return Docutils nodes for the tests
-        return flatten(list(map(Adapter(self), tests)))
+        return flatten([Adapter(self, section)(test) for test, section
+                        in zip(tests, parse_documentation(self, tests))])
 
 
 class KeywordsDirective(Directive):
@@ -514,6 +1737,7 @@ class KeywordsDirective(Directive):
         'style': style
     }
 
+    @profiled
     def run(self):
         path = resolve_path(self.options.get('source',
                                              self.options.get('suite',
@@ -522,30 +1746,634 @@ class KeywordsDirective(Directive):
                                              ),
                             os.path.dirname(self.state.document.current_source)
                             )
-
-        try:
-            resource = robot.parsing.TestData(source=path)
-        except robot.errors.DataError:
-            resource = robot.parsing.ResourceFile(source=path)
-            resource.populate()
+        note_source(self, path)
 
         if self.content:
-            needle = re.compile(self.content[0].strip(), re.U)
+            pattern = self.content[0].strip()
         else:
-            needle = re.compile('.*', re.U)
+            pattern = ''
+
+        with profiler.phase('filter'):
+            keywords = get_keyword_index(path).filter(pattern)
+
+        return flatten([Adapter(self, section)(keyword) for keyword, section
+                        in zip(keywords, parse_documentation(self, keywords))])
+
+
+RESOURCE_EXTENSIONS = SUITE_EXTENSIONS + ('.resource',)
+
+
+def get_resource_files(path):
+    """Return the given file or Robot files below the given directory"""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted([name for name in dirnames
+                              if not name.startswith('.')])
+        for name in sorted(filenames):
+            if not name.startswith('.') and \
+                    os.path.splitext(name)[1].lower() in RESOURCE_EXTENSIONS:
+                files.append(os.path.join(dirpath, name))
+    return files
+
+
+def get_table(headers, rows):
+    """Return table node with the given header texts and rows of nodes"""
+    rows = [list(cells) for cells in rows]
+    table = nodes.table()
+    tgroup = nodes.tgroup(cols=len(headers))
+    table += tgroup
+    for idx, header in enumerate(headers):
+        # Text writers use the widths as characters
+        tgroup += nodes.colspec(colwidth=max(
+            [len(header)] + [len(cells[idx].astext()) for cells in rows
+                             if idx < len(cells)]))
+    thead = nodes.thead()
+    tbody = nodes.tbody()
+    tgroup += thead
+    tgroup += tbody
+    row = nodes.row()
+    for header in headers:
+        row += nodes.entry('', nodes.paragraph(text=header))
+    thead += row
+    for cells in rows:
+        row = nodes.row()
+        for cell in cells:
+            row += nodes.entry('', nodes.paragraph('', '', cell))
+        tbody += row
+    return table
+
+
+def get_reference(text, section):
+    if not section['ids']:
+        return nodes.Text(text)
+    return nodes.reference('', text, internal=True, refid=section['ids'][0])
+
+
+class SearchDirective(Directive):
+    """Robot test and keyword search box directive"""
+    has_content = False
+
+    def run(self):
+        return [nodes.raw(
+            '', '<input class="robotdoc-search" type="search" '
+            'placeholder="Search Robot tests and keywords" />\n'
+            '<ul class="robotdoc-search-results"></ul>\n', format='html')]
+
+
+class LibraryDirective(Directive):
+    """Robot keyword library directive"""
+    has_content = False
 
-        keywords = [x for x in resource.keywords if needle.match(x.name)]
+    option_spec = {
+        'source': directives.path,
+        'resource': directives.path,  # alias for 'source'
+        'style': style
+    }
 
-        return flatten(list(map(Adapter(self), keywords)))
+    @profiled
+    def run(self):
+        path = resolve_path(
+            self.options.get('source', self.options.get('resource')),
+            os.path.dirname(self.state.document.current_source)
+        )
+        note_source(self, path, 'resource')
+
+        # Keywords of all the files are parsed and documented in one batch
+        groups = [(filename, parse_source(filename).keywords)
+                  for filename in get_resource_files(path)]
+        groups = [(filename, keywords) for filename, keywords in groups
+                  if keywords]
+        keywords = flatten([keywords for filename, keywords in groups])
+        sections = iter(parse_documentation(self, keywords))
+
+        document = self.state.document
+        result = []
+        rows = []
+        for filename, keywords in groups:
+            if os.path.isdir(path):
+                name = os.path.relpath(filename, path).replace(os.sep, '/')
+                group = nodes.section('', nodes.title(text=name),
+                                      names=[nodes.fully_normalize_name(name)])
+                document.note_implicit_target(group, group)
+                result.append(group)
+            else:
+                group = None
+            for keyword in keywords:
+                section = next(sections)
+                arguments = keyword.get_setting('arguments') or ()
+                rows.append([
+                    get_reference(keyword.name, section),
+                    nodes.Text('  '.join(arguments[1:])),
+                    group and get_reference(name, group) or
+                    nodes.Text(os.path.basename(filename)),
+                ])
+                nodes_ = Adapter(self, section)(keyword)
+                if group is None:
+                    result.extend(nodes_)
+                else:
+                    group.extend(nodes_)
+
+        if not rows:
+            return []
+        table = get_table(['Keyword', 'Arguments', 'Source'], rows)
+        table['classes'].append('robot-library-index')
+        return [table] + result
+
+
+def note_source(directive, path, kind='suite'):
+    """Register the given Robot source as a dependency of the document
+
+    Directories register the Robot files read from them for the given kind
+    (see :func:`get_source_files`). The source signatures are stored into
+    the environment for :func:`get_outdated_docs`.
+    """
+    if not os.path.exists(path):
+        return
+    env = directive.state.document.settings.env
+    profiler.set('source', path)
+    signature, size = get_source_signature(path, kind)
+    if os.path.isdir(path):
+        for filename, mtime, size in signature[1]:
+            env.note_dependency(filename)
+    else:
+        env.note_dependency(signature[0])
+    if not hasattr(env, 'robotdoc_sources'):
+        env.robotdoc_sources = {}
+    env.robotdoc_sources.setdefault(env.docname, {})[signature[0]] = signature
+
+
+def note_snippets(app, doctree):
+    """Count the robot_code and robot_data nodes by their content"""
+    env = app.env
+    counts = {}
+    for node in doctree.findall(
+            lambda node: isinstance(node, (robot_code, robot_data))):
+        counts[get_snippet_id(node)] = counts.get(get_snippet_id(node), 0) + 1
+    if not hasattr(env, 'robotdoc_snippet_refs'):
+        env.robotdoc_snippet_refs = {}
+    env.robotdoc_snippet_refs[env.docname] = counts
+
+
+def collect_snippets(app, env):
+    """Drop unreferenced snippets and count references of the others"""
+    counts = {}
+    for refs in getattr(env, 'robotdoc_snippet_refs', {}).values():
+        for snippet, count in refs.items():
+            counts[snippet] = counts.get(snippet, 0) + count
+    env.robotdoc_snippet_counts = counts
+    env.robotdoc_snippets = dict(
+        [(digest, code) for digest, code
+         in getattr(env, 'robotdoc_snippets', {}).items()
+         if digest in counts])
+    return []
+
+
+def purge_sources(app, env, docname):
+    for name in ('robotdoc_sources', 'robotdoc_profile',
+                 'robotdoc_snippet_refs', 'robotdoc_search'):
+        if hasattr(env, name):
+            getattr(env, name).pop(docname, None)
+
+
+def merge_sources(app, env, docnames, other):
+    for name in ('robotdoc_sources', 'robotdoc_profile',
+                 'robotdoc_snippet_refs', 'robotdoc_search'):
+        if not hasattr(env, name):
+            setattr(env, name, {})
+        for docname in docnames:
+            if docname in getattr(other, name, {}):
+                getattr(env, name)[docname] = getattr(other, name)[docname]
+    if not hasattr(env, 'robotdoc_snippets'):
+        env.robotdoc_snippets = {}
+    env.robotdoc_snippets.update(getattr(other, 'robotdoc_snippets', {}))
+
+
+def get_outdated_docs(app, env, added, changed, removed):
+    """Return documents embedding Robot sources changed since last read"""
+    signatures = {}
+    outdated = []
+    for docname, sources in getattr(env, 'robotdoc_sources', {}).items():
+        if docname in removed or docname in changed:
+            continue
+        for key, signature in sources.items():
+            if key not in signatures:
+                try:
+                    # Directories are stored by their path and kind
+                    signatures[key] = get_source_signature(
+                        *(isinstance(key, tuple) and key or (key,)))[0]
+                except OSError:
+                    signatures[key] = None
+            if signatures[key] != signature:
+                outdated.append(docname)
+                break
+    return outdated
+
+
+def note_read_docs(app, env, docnames):
+    """Remember the documents read by the current build for the report"""
+    profiler.docnames.update(docnames)
+
+
+def report_profile(app, exception):
+    """Write profile records as JSON and log the slowest directives"""
+    if exception is not None or not profiler.enabled:
+        return
+    records = flatten([
+        records for docname, records
+        in getattr(app.env, 'robotdoc_profile', {}).items()
+        if docname in profiler.docnames])
+    records.sort(key=lambda record: record['total'], reverse=True)
+    filename = os.path.join(app.outdir, 'robotdoc-profile.json')
+    with open(filename, 'w') as fp:
+        json.dump(records, fp, indent=2, sort_keys=True)
+    logger.info('robotdoc: profile of %d directives written to %s',
+                len(records), filename)
+    for record in records[:10]:
+        logger.info(
+            '%8.3fs  %s:%s %s (%s)  %s  cache %d/%d  disk cache %d/%d',
+            record['total'], record['docname'], record['line'],
+            record['directive'], record['source'],
+            '  '.join(['%s %.3fs' % (name, record[name])
+                       for name in Profiler.PHASES]),
+            record['cache_hits'], record['cache_hits'] +
+            record['cache_misses'], record['disk_cache_hits'],
+            record['disk_cache_hits'] + record['disk_cache_misses'])
+
+
+def add_latex_preamble(app):
+    """Add Pygments LaTeX style definitions for LaTeX builders"""
+    if app.builder.format != 'latex':
+        return
+    from pygments.formatters import LatexFormatter
+    if 'preamble' not in app.config.latex_elements:
+        app.config.latex_elements['preamble'] = ''
+    app.config.latex_elements['preamble'] += '''\
+\\usepackage{fancyvrb}
+\\usepackage{color}
+''' + LatexFormatter().get_style_defs()
+    if hasattr(app.builder, 'context'):
+        # The builder has already read latex_elements into its context
+        app.builder.context['preamble'] = app.config.latex_elements['preamble']
+
+
+SNIPPET_SCRIPT = '''\
+// Load Robot code shared by several pages (robotdoc_shared_snippet_size)
+document.addEventListener('DOMContentLoaded', function () {
+  var nodes = document.querySelectorAll('div.robotdoc-snippet[data-src]');
+  Array.prototype.forEach.call(nodes, function (node) {
+    var request = new XMLHttpRequest();
+    request.onload = function () {
+      if (request.status === 200 || request.status === 0) {
+        node.outerHTML = request.responseText;
+      }
+    };
+    request.open('GET', node.getAttribute('data-src'));
+    request.send();
+  });
+});
+'''
+
+
+def add_snippet_script(app):
+    """Add the script loading shared snippets for HTML builders"""
+    if app.config.robotdoc_shared_snippet_size and \
+            app.builder.format == 'html':
+        app.add_js_file('robotdoc.js')
+
+
+def write_snippet_script(app, exception):
+    if exception is None and app.config.robotdoc_shared_snippet_size and \
+            app.builder.format == 'html':
+        write_file(os.path.join(app.outdir, '_static', 'robotdoc.js'),
+                   SNIPPET_SCRIPT)
+
+
+SEARCH_SCRIPT = '''\
+// Prefix and substring search of Robot tests and keywords
+var RobotdocSearch = {
+  index: null,
+  callbacks: [],
+
+  root: function () {
+    var root = document.documentElement.getAttribute('data-content_root');
+    if (root === null && window.DOCUMENTATION_OPTIONS) {
+      root = DOCUMENTATION_OPTIONS.URL_ROOT;
+    }
+    return root || '';
+  },
+
+  normalize: function (name) {
+    return name.toLowerCase().replace(/[ _]/g, '');
+  },
+
+  setIndex: function (index) {
+    var self = this;
+    index.keys = index.objects.map(function (obj) {
+      return self.normalize(obj[1]);
+    });
+    this.index = index;
+    this.callbacks.splice(0).forEach(function (callback) { callback(); });
+  },
+
+  load: function (callback) {
+    if (this.index !== null) {
+      callback();
+    } else if (this.callbacks.push(callback) === 1) {
+      var script = document.createElement('script');
+      script.src = this.root() + '_static/robotdoc-searchindex.js';
+      document.head.appendChild(script);
+    }
+  },
+
+  // Return [type, name, arguments, tags, source, url] of the objects with
+  // name starting with the query followed by those containing it; with
+  // 'tag:' prefix, return the objects with a tag starting with the query
+  search: function (query, limit) {
+    var index = this.index, root = this.root();
+    var prefix = [], substring = [];
+    var tag = query.indexOf('tag:') === 0;
+    var needle = tag ? query.slice(4).trim().toLowerCase()
+                     : this.normalize(query);
+    if (!needle) {
+      return [];
+    }
+    index.objects.forEach(function (obj, idx) {
+      var position = tag ? (obj[3].some(function (name) {
+        return name.toLowerCase().indexOf(needle) === 0;
+      }) ? 0 : -1) : index.keys[idx].indexOf(needle);
+      if (position !== -1) {
+        (position === 0 ? prefix : substring).push(obj.slice(0, 5).concat(
+          [root + index.docs[obj[5]] + '#' + obj[6]]));
+      }
+    });
+    return prefix.concat(substring).slice(0, limit || 50);
+  }
+};
+
+document.addEventListener('DOMContentLoaded', function () {
+  var inputs = document.querySelectorAll('input.robotdoc-search');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var results = input.nextElementSibling;
+    input.addEventListener('input', function () {
+      RobotdocSearch.load(function () {
+        results.innerHTML = '';
+        RobotdocSearch.search(input.value).forEach(function (obj) {
+          var item = document.createElement('li');
+          var link = document.createElement('a');
+          link.href = obj[5];
+          link.textContent = obj[1];
+          item.appendChild(link);
+          item.appendChild(document.createTextNode(
+            (obj[2].length ? '  ' + obj[2].join('  ') : '') +
+            ' (' + (obj[0] === 'test' ? 'test' : 'keyword') + ', ' + obj[4] +
+            (obj[3].length ? ', ' + obj[3].join(', ') : '') + ')'));
+          results.appendChild(item);
+        });
+      });
+    });
+  });
+});
+'''
+
+
+def add_search_script(app):
+    if app.config.robotdoc_search_index and app.builder.format == 'html':
+        app.add_js_file('robotdoc-search.js')
+
+
+def write_search_index(app, exception):
+    """Write the search index of embedded tests and keywords as a script
+
+    Entries are [type, name, arguments, tags, source file, document index,
+    anchor]. The index is a script rather than JSON to be loadable also
+    from the local file system.
+    """
+    if exception is not None or not app.config.robotdoc_search_index or \
+            app.builder.format != 'html':
+        return
+    entries = getattr(app.env, 'robotdoc_search', {})
+    docnames = sorted(entries)
+    objects = []
+    for idx, docname in enumerate(docnames):
+        for entry in entries[docname]:
+            objects.append(entry[:5] + [idx, entry[5]])
+    index = {
+        'docs': [app.builder.get_target_uri(docname) for docname in docnames],
+        'objects': objects,
+    }
+    static = os.path.join(app.outdir, '_static')
+    write_file(os.path.join(static, 'robotdoc-search.js'), SEARCH_SCRIPT)
+    write_file(os.path.join(static, 'robotdoc-searchindex.js'),
+               u'RobotdocSearch.setIndex(%s);\n' % json.dumps(
+                   index, separators=(',', ':'), sort_keys=True))
+
+
+def configure_cache(app):
+    resolved_paths.clear()
+    profiler.enabled = bool(app.config.robotdoc_profile)
+    profiler.docnames.clear()
+    sources.encoding = app.config.robotdoc_source_encoding
+    sources.stream_size = app.config.robotdoc_stream_size
+    parsed_sources.resize(app.config.robotdoc_cache_size)
+    if app.config.robotdoc_cache_dir:
+        rendered_sources.path = os.path.join(
+            app.confdir, app.config.robotdoc_cache_dir)
+    else:
+        rendered_sources.path = None
+
+
+# Robot directives and their source options looked up from the documents to
+# be read, and the cached data each directive needs
+DIRECTIVE_PATTERN = re.compile(r'^(\s*)\.\.\s+robot[-_](\w+)::')
+SOURCE_OPTION_PATTERN = re.compile(
+    r'^\s+:(?:source|suite|resource):\s*(\S.*?)\s*$')
+PRERENDER_KINDS = {
+    'source': ('tokens',),
+    'settings': ('suite', 'tokens'),
+    'variables': ('tokens',),
+    'tests': ('suite',),
+    'keywords': ('suite',),
+    'library': ('suite',),
+}
+
+
+def scan_document(filename, encoding):
+    """Return (directive, source option) pairs of robot directives in a file"""
+    found = []
+    directive = indent = None
+    with io.open(filename, 'r', encoding=encoding) as fp:
+        for line in fp:
+            match = DIRECTIVE_PATTERN.match(line)
+            if match:
+                directive, indent = match.group(2), len(match.group(1))
+            elif directive is None or not line.strip():
+                continue
+            elif len(line) - len(line.lstrip()) <= indent:
+                directive = None
+            else:
+                match = SOURCE_OPTION_PATTERN.match(line)
+                if match and directive in PRERENDER_KINDS:
+                    found.append((directive, match.group(1)))
+                    directive = None
+    return found
+
+
+def get_prerender_jobs(app, env, docnames):
+    """Return (path, kinds) pairs of the sources to pre-render, largest first
+
+    Sources are looked up from the robot directives of the given documents
+    or, when ``robotdoc_prerender`` is set, from its glob patterns.
+    """
+    kinds = {}
+    if app.config.robotdoc_prerender:
+        for pattern in app.config.robotdoc_prerender:
+            for path in glob.glob(os.path.join(app.confdir, pattern),
+                                  recursive=True):
+                kinds[path] = set(['suite', 'tokens'])
+    else:
+        for docname in docnames:
+            filename = os.fspath(env.doc2path(docname))
+            try:
+                found = scan_document(filename, app.config.source_encoding)
+            except (IOError, UnicodeError):
+                continue
+            for directive, spec in found:
+                path = resolve_path(spec, os.path.dirname(filename))
+                if directive == 'tests' and os.path.isdir(path):
+                    continue  # loaded lazily by the matching files
+                if directive == 'library' and os.path.isdir(path):
+                    paths = get_resource_files(path)
+                else:
+                    paths = [path]
+                for path in paths:
+                    kinds.setdefault(path, set()).update(
+                        PRERENDER_KINDS[directive])
+    jobs = []
+    for path, kinds_ in kinds.items():
+        if not os.path.exists(path):
+            continue
+        if os.path.isdir(path) or \
+                os.path.getsize(path) > sources.stream_size:
+            # Suite directories are not tokenized and huge files are streamed
+            kinds_.discard('tokens')
+        if kinds_:
+            jobs.append((get_source_signature(path)[1], path, kinds_))
+    return [(path, kinds_) for size, path, kinds_
+            in sorted(jobs, key=lambda job: job[0], reverse=True)]
+
+
+def configure_worker(encoding, stream_size, cache_dir):
+    profiler.enabled = False
+    sources.encoding = encoding
+    sources.stream_size = stream_size
+    rendered_sources.path = cache_dir
+
+
+def prerender_source(job):
+    """Parse and tokenize the given source in a pre-render worker process
+
+    Token types are returned by name, because unpickled token types would
+    not be the singletons the lexer and the table index compare against.
+    """
+    path, kinds = job
+    try:
+        result = {'hash': get_source_hash(path)}
+        if 'suite' in kinds:
+            result['suite'] = parse_source(path)
+        if 'tokens' in kinds:
+            result['tokens'] = [(str(ttype), value)
+                                for ttype, value in get_tokens(path)]
+        return path, result
+    except Exception:  # reported by the directive in the main process
+        return path, None
+    finally:
+        parsed_sources.clear()
+
+
+def prerender_sources(app, env, docnames):
+    """Warm the caches with sources parsed and tokenized in worker processes
+
+    Enabled with ``robotdoc_workers``, so that robot directives read later
+    need only look up the cached sources.
+    """
+    if not app.config.robotdoc_workers:
+        return
+    from pygments.token import string_to_tokentype
+    jobs = get_prerender_jobs(app, env, docnames)
+    if not jobs:
+        return
+    token_types = {}
+    count = 0
+    with ProcessPoolExecutor(
+            max_workers=min(app.config.robotdoc_workers, len(jobs)),
+            initializer=configure_worker,
+            initargs=(sources.encoding, sources.stream_size,
+                      rendered_sources.path)) as executor:
+        for path, result in executor.map(prerender_source, jobs):
+            if result is None:
+                continue
+            if 'tokens' in result:
+                for name, value in result['tokens']:
+                    if name not in token_types:
+                        token_types[name] = string_to_tokentype(name)
+                result['tokens'] = [(token_types[name], value)
+                                    for name, value in result['tokens']]
+            for kind, value in result.items():
+                parsed_sources.get(kind, path, lambda path_: value)
+            count += 1
+    logger.info('robotdoc: pre-rendered %d sources with %d workers',
+                count, min(app.config.robotdoc_workers, len(jobs)))
 
 
 def setup(app):
+    # Configuration:
+    app.add_config_value('robotdoc_cache_size', 32 * 1024 * 1024, '')
+    app.add_config_value('robotdoc_cache_dir', None, '')
+    app.add_config_value('robotdoc_profile', False, '')
+    app.add_config_value('robotdoc_stream_size', 4 * 1024 * 1024, '')
+    app.add_config_value('robotdoc_source_encoding', 'utf-8-sig', '')
+    app.add_config_value('robotdoc_workers', 0, '')
+    app.add_config_value('robotdoc_prerender', None, '')
+    app.add_config_value('robotdoc_shared_snippet_size', None, '')
+    app.add_config_value('robotdoc_search_index', False, 'env')
+    app.connect('builder-inited', configure_cache)
+    app.connect('env-before-read-docs', prerender_sources)
+
+    # Dependencies:
+    app.connect('env-purge-doc', purge_sources)
+    app.connect('env-merge-info', merge_sources)
+    app.connect('env-get-outdated', get_outdated_docs)
+
+    # Snippets:
+    app.connect('doctree-read', note_snippets)
+    app.connect('env-updated', collect_snippets)
+    app.connect('builder-inited', add_snippet_script)
+    app.connect('build-finished', write_snippet_script)
+
+    # Search:
+    app.connect('builder-inited', add_search_script)
+    app.connect('build-finished', write_search_index)
+
+    # Profiling:
+    app.connect('env-before-read-docs', note_read_docs)
+    app.connect('build-finished', report_profile)
+
+    # Nodes:
+    app.add_node(robot_code)
+    app.add_node(robot_data)
+    app.add_domain(RobotDomain)
+    app.add_post_transform(RobotCodeRenderer)
+
     # Directives:
     app.add_directive('robot-source', SourceDirective)
     app.add_directive('robot-settings', SettingsDirective)
     app.add_directive('robot-variables', VariablesDirective)
     app.add_directive('robot-tests', TestCasesDirective)
     app.add_directive('robot-keywords', KeywordsDirective)
+    app.add_directive('robot-library', LibraryDirective)
+    app.add_directive('robot-search', SearchDirective)
 
     # BBB:
     app.add_directive('robot_source', SourceDirective)
@@ -555,9 +2383,9 @@ def setup(app):
     app.add_directive('robot_keywords', KeywordsDirective)
 
     # LaTeX-support:
-    if 'preamble' not in app.config.latex_elements:
-        app.config.latex_elements['preamble'] = ''
-    app.config.latex_elements['preamble'] += '''\
-\\usepackage{fancyvrb}
-\\usepackage{color}
-''' + LatexFormatter().get_style_defs()
+    app.connect('builder-inited', add_latex_preamble)
+
+    return {
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }